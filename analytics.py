@@ -0,0 +1,41 @@
+import json
+import argparse
+
+from src.storage import load_blockchain
+from src.columns import export_columns, save_columns, load_columns
+from src.analytics import report
+
+
+"""
+===========
+ MAIN CODE
+===========
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--file', type=str, help='file storing the blockchain (default: \'blockchain.json\')')
+parser.add_argument('--columns', type=str, help='columns exported by a previous run, read instead of the blockchain file')
+parser.add_argument('--export', type=str, help='output file of the columns of the blockchain (eg: \'chain.npz\')')
+parser.add_argument('--top', type=int, help='number of miners in the report (default: 10)')
+parser.add_argument('--window', type=float, help='seconds per bucket of the throughput over time (default: 3600)')
+parser.add_argument('-o', type=str, help='output file of the report (default: printed)')
+
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    if args.columns:
+        columns = load_columns(args.columns)
+    else:
+        columns = export_columns(load_blockchain(args.file or 'blockchain.json'))
+
+    if args.export:
+        save_columns(columns, args.export)
+        print(f'Exported {len(columns["height"])} blocks and {len(columns["tx_height"])} transactions to {args.export}')
+
+    summary = report(columns, top=args.top or 10, window=args.window or 60*60)
+
+    if args.o:
+        with open(args.o, 'w') as outfile:
+            json.dump(summary, outfile, indent=4)
+    else:
+        print(json.dumps(summary, indent=4))
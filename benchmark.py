@@ -0,0 +1,592 @@
+import os
+import sys
+import copy
+import time
+import json
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+from statistics import mean
+
+from src.nodes import BlockchainNode, MinerNode, SPVNode, PoolCoordinatorNode, PoolWorkerNode
+from src.blockchain import Blockchain
+from src.peers import AddressBook
+from src.wallet import Wallet
+from src.mempool import MempoolJournal
+from src.cache import BlockCache
+from src.simulator import SimulatedNetwork
+from src.snapshot import create_snapshot, load_snapshot, tx_info_hash
+
+
+"""
+===========
+ HELPERS
+===========
+"""
+
+
+def build_chain(height):
+    """
+    Mine a valid blockchain of the given height without any networking
+
+    @param height: <int> Number of blocks (including the genesis block)
+
+    @return: <Blockchain>
+    """
+
+    blockchain = Blockchain()
+
+    while len(blockchain.chain) < height:
+        mine_block(blockchain, 'benchmark')
+
+    return blockchain
+
+
+def mine_block(blockchain, recipient):
+    """
+    Mine the next block of a blockchain
+
+    @param blockchain: <Blockchain>
+    @param recipient: <str> Address the block's reward is sent to
+
+    @return: <str> Hash of the reward
+    """
+
+    prev_hash = Blockchain.hash(blockchain.last_block['header'])
+
+    proof = 0
+    while Blockchain.valid_proof(prev_hash, proof) is False:
+        proof += 1
+
+    reward = Blockchain.tx_hash(blockchain.add_reward(recipient))
+    blockchain.add_block(proof, prev_hash)
+
+    return reward
+
+
+def funded_copy(blockchain, wallet):
+    """
+    Copy of a blockchain with one more block, whose reward goes to a wallet so it can send transactions
+
+    @return: (<Blockchain>, <str> hash of the reward)
+    """
+
+    blockchain = full_copy(blockchain)
+    return blockchain, mine_block(blockchain, wallet.address)
+
+
+def full_copy(blockchain, height=None):
+    chain = blockchain.chain[:height] if height else blockchain.chain
+    return Blockchain(copy.deepcopy(chain), copy.deepcopy(blockchain.tx_info))
+
+
+def headers_copy(blockchain, height=None):
+    chain = blockchain.chain[:height] if height else blockchain.chain
+    return Blockchain([copy.deepcopy(block['header']) for block in chain])
+
+
+def wait_for(condition, timeout):
+    """
+    Poll a condition until it is True
+
+    @return: <float> Seconds it took, or None if it timed out
+    """
+
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            return None
+        time.sleep(0.001)
+
+    return time.time() - start
+
+
+def connect(nodes, timeout):
+    """
+    Handshake every node with the network the same way the clients do
+
+    Every node announces itself at least once, a node already marked ready by
+    another node's handshake would otherwise never be known by the rest
+
+    @return: <bool> True if every node received a verack and knows every other node
+    """
+
+    deadline = time.time() + timeout
+    for node in nodes:
+        while not node.connect(timeout=0.5):
+            if time.time() > deadline:
+                return False
+
+    # Wait for everybody to know about each other
+    return wait_for(lambda: all(len(node.peers) == len(nodes) - 1 for node in nodes), max(0, deadline - time.time())) is not None
+
+
+def stop(network, nodes):
+    for node in nodes:
+        node.stop()
+    network.stop()
+
+
+def new_network(args):
+    network = SimulatedNetwork(
+        latency=args.latency,
+        jitter=args.jitter,
+        loss=args.loss,
+        bandwidth=args.bandwidth,
+        seed=args.seed
+    )
+    network.start()
+    return network
+
+
+"""
+============
+ BENCHMARKS
+============
+"""
+
+
+def bench_propagation(args, genesis):
+    """
+    Block propagation latency: time from a miner broadcasting a block until every node has it
+    """
+
+    network = new_network(args)
+    miner = network.spawn(MinerNode, 'miner-0', full_copy(genesis))
+    full_nodes = [network.spawn(BlockchainNode, f'full-{i}', full_copy(genesis)) for i in range(args.full)]
+    spv_nodes = [network.spawn(SPVNode, f'spv-{i}', headers_copy(genesis)) for i in range(args.spv)]
+    nodes = [miner] + full_nodes + spv_nodes
+
+    try:
+        if not connect(nodes, args.timeout):
+            return {'error': 'handshake timed out'}
+
+        network.reset_stats()
+        latencies = []
+        mine_times = []
+
+        for _ in range(args.blocks):
+            start = time.time()
+            miner.mine()
+            mined = time.time()
+            mine_times.append(mined - start)
+
+            height = len(miner.blockchain.chain)
+            elapsed = wait_for(lambda: all(len(node.blockchain.chain) >= height for node in nodes), args.timeout)
+            if elapsed is None:
+                return {'error': f'block {height} did not propagate'}
+            latencies.append(elapsed)
+
+        validations = [node.metrics.get('validation_seconds', kind='block') for node in full_nodes]
+        validations = [v for v in validations if v]
+
+        return {
+            'nodes': len(nodes),
+            'blocks': args.blocks,
+            'latency_mean': mean(latencies),
+            'latency_max': max(latencies),
+            'mine_time_mean': mean(mine_times),
+            'hash_rate': miner.metrics.get('hash_rate'),
+            'validation_mean': sum(v['sum'] for v in validations) / max(1, sum(v['count'] for v in validations)),
+            **network.stats
+        }
+    finally:
+        stop(network, nodes)
+
+
+def bench_pool(args, genesis):
+    """
+    Mining pool: blocks found by workers searching the proof ranges handed out by a coordinator
+
+    Note: Workers share one process here, their hash rates only add up on separate hosts
+    """
+
+    network = new_network(args)
+    coordinator = network.spawn(PoolCoordinatorNode, 'pool-0', full_copy(genesis))
+    workers = [network.spawn(PoolWorkerNode, f'worker-{i}') for i in range(args.workers)]
+    nodes = [coordinator] + workers
+
+    mining = True
+
+    def work(worker):
+        worker.request_work()
+        while mining:
+            if not worker.mine():
+                time.sleep(0.01)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in workers]
+
+    try:
+        if not connect(nodes, args.timeout):
+            return {'error': 'handshake timed out'}
+
+        network.reset_stats()
+        start = time.time()
+        [thread.start() for thread in threads]
+
+        height = len(coordinator.blockchain.chain) + args.blocks
+        elapsed = wait_for(lambda: len(coordinator.blockchain.chain) >= height, args.timeout)
+        if elapsed is None:
+            return {'error': f'only {len(coordinator.blockchain.chain) - 1} of {args.blocks} blocks were found'}
+
+        elapsed = time.time() - start
+        hashes = sum(worker.metrics.get('hashes') or 0 for worker in workers)
+        stats = coordinator.pool.workers.values()
+
+        return {
+            'workers': args.workers,
+            'blocks': args.blocks,
+            'elapsed': elapsed,
+            'hashes': hashes,
+            'hash_rate': hashes / elapsed,
+            'shares': sum(worker['shares'] for worker in stats),
+            'stale': sum(worker['stale'] for worker in stats),
+            **network.stats
+        }
+    finally:
+        mining = False
+        [thread.join() for thread in threads if thread.is_alive()]
+        stop(network, nodes)
+
+
+def bench_throughput(args, genesis):
+    """
+    Transaction throughput: how fast a stream of addtx messages ends up in a miner's transaction pool
+    """
+
+    wallet = Wallet()
+    funded, reward = funded_copy(genesis, wallet)
+
+    network = new_network(args)
+    miner = network.spawn(MinerNode, 'miner-0', full_copy(funded))
+    sender = network.spawn(BlockchainNode, 'full-0', full_copy(funded), wallet=wallet)
+    nodes = [miner, sender]
+
+    try:
+        if not connect(nodes, args.timeout):
+            return {'error': 'handshake timed out'}
+
+        # Signing is the wallet's work, not the nodes'
+        txs = [wallet.create_transaction('benchmark', i % Blockchain.reward, reward) for i in range(args.txs)]
+
+        network.reset_stats()
+        start = time.time()
+
+        for tx in txs:
+            sender.send('addtx', message=json.dumps({
+                'tx': json.dumps(tx)
+            }))
+
+        elapsed = wait_for(lambda: len(miner.blockchain.transaction_pool) >= args.txs, args.timeout)
+        if elapsed is None:
+            return {'error': f'only {len(miner.blockchain.transaction_pool)} of {args.txs} transactions arrived'}
+
+        elapsed = time.time() - start
+        return {
+            'txs': args.txs,
+            'elapsed': elapsed,
+            'txs_per_second': args.txs / elapsed,
+            'signatures_verified': miner.blockchain.verifier.misses,
+            **network.stats
+        }
+    finally:
+        stop(network, nodes)
+
+
+def bench_mempool(args, genesis):
+    """
+    Mempool restart: how long a miner takes to journal its pending transactions and replay them after a restart
+    """
+
+    wallet = Wallet()
+    genesis, reward = funded_copy(genesis, wallet)
+    txs = [wallet.create_transaction('benchmark', i % Blockchain.reward, reward) for i in range(args.txs)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'mempool.log')
+
+        # First run: transactions enter the pool
+        blockchain = full_copy(genesis)
+        blockchain.restore_pool(MempoolJournal(filename))
+
+        start = time.time()
+        for tx in txs:
+            blockchain.verify_and_add_transaction(**tx)
+        admit_time = time.time() - start
+
+        blockchain.journal.close()
+        blockchain.verifier.close()
+        journal_bytes = os.path.getsize(filename)
+
+        # Second run: only the chain was saved
+        blockchain = full_copy(genesis)
+
+        start = time.time()
+        restored = blockchain.restore_pool(MempoolJournal(filename))
+        replay_time = time.time() - start
+
+        blockchain.journal.close()
+        blockchain.verifier.close()
+
+        return {
+            'txs': args.txs,
+            'restored': restored,
+            'admit_time': admit_time,
+            'replay_time': replay_time,
+            'txs_per_second': args.txs / replay_time,
+            'journal_bytes': journal_bytes
+        }
+
+
+def bench_serving(args, chain, requests=100):
+    """
+    Serving cost: time to encode the getheaders and getblocks (latest blocks) responses of many syncing peers
+    """
+
+    blockchain = full_copy(chain)
+    height = len(blockchain.chain)
+    indices = list(range(max(1, height - BlockchainNode.sync_window + 1), height + 1))
+
+    # Every response encoded from the chain, as without a cache
+    start = time.time()
+    for _ in range(requests):
+        json.dumps({'headers': [block['header'] for block in blockchain.chain]})
+        blocks = [blockchain.chain[index - 1] for index in indices]
+        json.dumps({
+            'request': 0,
+            'blocks': blocks,
+            'tx_info': {tx_hash: blockchain.tx_info[tx_hash] for block in blocks for tx_hash in block['transactions']}
+        })
+    uncached = time.time() - start
+
+    cache = BlockCache(blockchain)
+    start = time.time()
+    for _ in range(requests):
+        cache.headers_message()
+        cache.blocks_message(0, indices)
+    cached = time.time() - start
+
+    blockchain.verifier.close()
+
+    return {
+        'height': height,
+        'requests': requests,
+        'uncached_time': uncached,
+        'cached_time': cached,
+        'speedup': uncached / cached if cached else None,
+        **{f'{name}_hit_rate': stats['hit_rate'] for name, stats in cache.stats().items()}
+    }
+
+
+def bench_sync(args, chain, height, node_class):
+    """
+    Sync time: how long a fresh node takes to catch up with peers at the given height
+    """
+
+    network = new_network(args)
+    seeds = [network.spawn(BlockchainNode, f'full-{i}', full_copy(chain, height)) for i in range(args.seeds)]
+    fresh = network.spawn(node_class, 'fresh-0')
+    nodes = seeds + [fresh]
+
+    try:
+        if not connect(nodes, args.timeout):
+            return {'error': 'handshake timed out'}
+
+        network.reset_stats()
+        start = time.time()
+
+        while len(fresh.blockchain.chain) < height:
+            if time.time() - start > args.timeout:
+                return {'error': f'did not sync to height {height}'}
+
+            fresh.resolve_conflicts()
+            wait_for(lambda: len(fresh.blockchain.chain) >= height, args.retry)
+
+        return {
+            'height': height,
+            'elapsed': time.time() - start,
+            **network.stats
+        }
+    finally:
+        stop(network, nodes)
+
+
+def bench_restart(args, chain, height):
+    """
+    Restart time: how long a node 2 blocks behind takes to reconnect with the peers of its address book and sync
+    """
+
+    network = new_network(args)
+    seeds = [network.spawn(BlockchainNode, f'full-{i}', full_copy(chain, height)) for i in range(args.seeds)]
+    blockchain = full_copy(chain, max(1, height - 2))
+    nodes = seeds
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'peers.json')
+
+        try:
+            # First run: learn the peers, then stop
+            node = network.spawn(BlockchainNode, 'restarted-0', blockchain, address_book=AddressBook(filename))
+            if not connect(seeds + [node], args.timeout):
+                node.stop()
+                return {'error': 'handshake timed out'}
+            node.stop()
+
+            # Second run
+            network.reset_stats()
+            start = time.time()
+            node = network.spawn(BlockchainNode, 'restarted-0', blockchain, address_book=AddressBook(filename))
+            nodes = seeds + [node]
+
+            known = len(node.address_book.best(args.seeds))
+            while not node.connect():
+                if time.time() - start > args.timeout:
+                    return {'error': 'handshake timed out'}
+            connected = time.time() - start
+
+            while len(node.blockchain.chain) < height:
+                if time.time() - start > args.timeout:
+                    return {'error': f'did not sync to height {height}'}
+
+                node.sync(args.retry)
+                wait_for(lambda: len(node.blockchain.chain) >= height, args.retry)
+
+            return {
+                'height': height,
+                'known_peers': known,
+                'connect_time': connected,
+                'elapsed': time.time() - start,
+                **network.stats
+            }
+        finally:
+            stop(network, nodes)
+
+
+def bench_bootstrap(args, chain, height):
+    """
+    Bootstrap time: how long a fresh node takes to load a snapshot of 3/4 of the chain and sync the rest
+    """
+
+    snapshot = json.loads(json.dumps(create_snapshot(chain, max(1, height * 3 // 4))))
+    checkpoints = {snapshot['height']: snapshot['tip']}
+    tx_info_hashes = {snapshot['height']: tx_info_hash(snapshot['tx_info'])}
+
+    network = new_network(args)
+    seeds = [network.spawn(BlockchainNode, f'full-{i}', full_copy(chain, height)) for i in range(args.seeds)]
+    nodes = seeds
+
+    try:
+        start = time.time()
+        fresh = network.spawn(BlockchainNode, 'fresh-0', load_snapshot(snapshot, checkpoints, tx_info_hashes))
+        fresh.checkpoints = checkpoints
+        nodes = seeds + [fresh]
+        loaded = time.time() - start
+
+        if not connect(nodes, args.timeout):
+            return {'error': 'handshake timed out'}
+
+        network.reset_stats()
+        start = time.time()
+
+        while len(fresh.blockchain.chain) < height:
+            if time.time() - start > args.timeout:
+                return {'error': f'did not sync to height {height}'}
+
+            fresh.resolve_conflicts()
+            wait_for(lambda: len(fresh.blockchain.chain) >= height, args.retry)
+
+        return {
+            'height': height,
+            'snapshot_height': snapshot['height'],
+            'load_time': loaded,
+            'elapsed': time.time() - start,
+            **network.stats
+        }
+    finally:
+        stop(network, nodes)
+
+
+def compare(results, previous):
+    """
+    Print every numeric metric next to the one of a previous run
+    """
+
+    print(f'\n{"metric":<48}{"previous":>16}{"current":>16}{"change":>10}')
+
+    for name, metrics in results.items():
+        for key, value in metrics.items():
+            old = previous.get(name, {}).get(key)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+
+            change = f'{(value - old) / old * 100:+.1f}%' if old else ''
+            print(f'{name + "." + key:<48}{old:>16.4f}{value:>16.4f}{change:>10}')
+
+
+"""
+===========
+ MAIN CODE
+===========
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--full', type=int, default=8, help='full nodes in the propagation benchmark (default: 8)')
+parser.add_argument('--spv', type=int, default=4, help='SPV nodes in the propagation benchmark (default: 4)')
+parser.add_argument('--blocks', type=int, default=5, help='blocks mined in the propagation benchmark (default: 5)')
+parser.add_argument('--txs', type=int, default=200, help='transactions sent in the throughput benchmark (default: 200)')
+parser.add_argument('--workers', type=int, default=4, help='workers in the mining pool benchmark (default: 4)')
+parser.add_argument('--seeds', type=int, default=3, help='synced peers in the sync benchmark (default: 3)')
+parser.add_argument('--heights', type=str, default='5,10,20', help='comma separated chain heights for the sync benchmark (default: 5,10,20)')
+parser.add_argument('--latency', type=float, default=0.01, help='one-way link latency in seconds (default: 0.01)')
+parser.add_argument('--jitter', type=float, default=0.0, help='maximum latency jitter in seconds (default: 0)')
+parser.add_argument('--loss', type=float, default=0.0, help='packet loss probability (default: 0)')
+parser.add_argument('--bandwidth', type=int, help='upload bandwidth of each node in bytes per second (default: unlimited)')
+parser.add_argument('--seed', type=int, default=0, help='seed for the simulated network (default: 0)')
+parser.add_argument('--timeout', type=float, default=60, help='seconds before a benchmark gives up (default: 60)')
+parser.add_argument('--retry', type=float, default=1, help='seconds between sync attempts (default: 1)')
+parser.add_argument('-o', type=str, help='output file for the results (default: \'benchmark.json\')')
+parser.add_argument('--compare', type=str, help='results file of a previous run to compare against')
+parser.add_argument('-v', action='store_true', help='show the output of the nodes and every packet')
+
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    if args.v:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+
+    heights = sorted(int(height) for height in args.heights.split(','))
+
+    print(f'Mining a chain of height {heights[-1]}')
+    chain = build_chain(heights[-1])
+
+    results = {}
+    with contextlib.ExitStack() as stack:
+        if not args.v:
+            stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+
+        results['propagation'] = bench_propagation(args, full_copy(chain, 1))
+        results['throughput'] = bench_throughput(args, full_copy(chain, 1))
+        results['pool'] = bench_pool(args, full_copy(chain, 1))
+        results['mempool'] = bench_mempool(args, full_copy(chain, 1))
+        results['serving'] = bench_serving(args, chain)
+        for height in heights:
+            results[f'sync_full_{height}'] = bench_sync(args, chain, height, BlockchainNode)
+            results[f'sync_spv_{height}'] = bench_sync(args, chain, height, SPVNode)
+            results[f'bootstrap_{height}'] = bench_bootstrap(args, chain, height)
+            results[f'restart_{height}'] = bench_restart(args, chain, height)
+
+    print(json.dumps(results, indent=4))
+
+    with open(args.o or 'benchmark.json', 'w') as outfile:
+        json.dump({
+            'config': vars(args),
+            'results': results
+        }, outfile, indent=4)
+
+    if args.compare:
+        compare(results, json.load(open(args.compare))['results'])
+
+    if any('error' in metrics for metrics in results.values()):
+        sys.exit(1)
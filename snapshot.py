@@ -0,0 +1,42 @@
+import json
+import argparse
+
+from src.storage import load_blockchain
+from src.snapshot import create_snapshot, tx_info_hash
+
+
+"""
+===========
+ MAIN CODE
+===========
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--file', type=str, help='file storing a fully validated blockchain (default: \'blockchain.json\')')
+parser.add_argument('--height', type=int, help='index of the last block in the snapshot (default: the tip)')
+parser.add_argument('-o', type=str, help='output file of the snapshot (default: \'snapshot.json\')')
+parser.add_argument('--checkpoints', type=str, help='checkpoints file to add the snapshot\'s tip to')
+
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    blockchain = load_blockchain(args.file or 'blockchain.json')
+
+    snapshot = create_snapshot(blockchain, args.height)
+
+    with open(args.o or 'snapshot.json', 'w') as outfile:
+        json.dump(snapshot, outfile)
+
+    print(f'Snapshot of height {snapshot["height"]}, tip {snapshot["tip"]}')
+
+    if args.checkpoints:
+        try:
+            checkpoints = json.load(open(args.checkpoints))
+        except FileNotFoundError:
+            checkpoints = {}
+
+        # Nothing else commits to the snapshot's transactions, so their hash is signed off along with the tip
+        checkpoints[str(snapshot['height'])] = {'hash': snapshot['tip'], 'tx_info': tx_info_hash(snapshot['tx_info'])}
+
+        with open(args.checkpoints, 'w') as outfile:
+            json.dump(checkpoints, outfile, indent=4)
@@ -1,10 +1,16 @@
 from shortuuid import uuid
 import time
 import json
+import logging
 import argparse
 
 from src.nodes import SPVNode
 from src.blockchain import Blockchain
+from src.wallet import Wallet
+from src.peers import AddressBook
+from src.metrics import SamplingProfiler, start_exporters
+from src.snapshot import load_checkpoints
+from src.storage import load_blockchain
 
 
 """
@@ -18,16 +24,27 @@ parser.add_argument('-n', type=str, help='node name')
 parser.add_argument('-p', type=int, help='port number (default: 5000)')
 parser.add_argument('--file', type=str, help='specified file storing the blockchain (default: \'blockchain.json\')')
 parser.add_argument('-o', type=str, help='output file without requiring an initial blockchain file to read from (default: \'blockchain.json\')')
+parser.add_argument('--wallet', type=str, help='file storing the node\'s private key, created if missing (default: \'wallet.pem\')')
+parser.add_argument('--peers', type=str, help='file of the peers known from previous runs (default: \'peers.json\')')
+parser.add_argument('--log', type=str, help='log level, DEBUG shows every packet (default: \'INFO\')')
+parser.add_argument('--metrics-port', type=int, help='serve metrics in the Prometheus text format on this port')
+parser.add_argument('--metrics-file', type=str, help='write a snapshot of the metrics to this file every 10 seconds')
+parser.add_argument('--checkpoints', type=str, help='file of signed-off block hashes, Proof of Work up to the highest one matched is assumed valid')
+parser.add_argument('--profile', type=str, help='profile a sample of the packets handled (and proofs of work) into this file')
 
 args = parser.parse_args()
 node_id = uuid()
 
 if __name__ == '__main__':
+    logging.basicConfig(level=(args.log or 'INFO').upper(), format='%(message)s')
+    profiler = SamplingProfiler() if args.profile else None
+
+    checkpoints = load_checkpoints(args.checkpoints) if args.checkpoints else {}
+
     # Load Blockchain File
     filename = args.file
     if filename:
-        data = json.load(open(filename))
-        blockchain = Blockchain(list(map(lambda block: block['header'], data['chain'])))
+        blockchain = load_blockchain(filename, headers_only=True)
     else:
         filename = args.o
         blockchain = Blockchain()
@@ -35,23 +52,27 @@ if __name__ == '__main__':
     node = SPVNode(
         name=args.n or f'node-{node_id}',
         port=args.p or 5000,
-        blockchain=blockchain
+        blockchain=blockchain,
+        profiler=profiler,
+        address_book=AddressBook(args.peers or 'peers.json'),
+        wallet=Wallet.load(args.wallet or 'wallet.pem')
     )
+    node.checkpoints = checkpoints
+    exporters = start_exporters(node.metrics, port=args.metrics_port, filename=args.metrics_file)
 
     try:
         print(f'Starting node-{node_id}')
 
-        # Establish Connection
-        while not node.ready:
-            node.send('version', message=json.dumps({
-                'height': len(node.blockchain.chain)
-            }))
-            time.sleep(1)
+        # Establish Connection, with the peers of the previous run first
+        while not node.connect():
+            pass
 
         # Sync up with the other nodes
-        while not node.synced:
-            node.resolve_conflicts()
-            time.sleep(5)
+        while not node.sync():
+            pass
+
+        # Only receive the transactions concerning us
+        node.load_filter([node.wallet.address])
 
         # Listen for new blocks being added
         while True:
@@ -63,10 +84,7 @@ if __name__ == '__main__':
                 previous_hash = input('Previous Hash: ')
 
                 tx = node.blockchain.verify_and_add_transaction(
-                    sender=node.identifier,
-                    recipient=recipient,
-                    amount=int(amount),
-                    previous_hash=previous_hash
+                    **node.wallet.create_transaction(recipient, int(amount), previous_hash)
                 )
 
                 if tx:
@@ -78,3 +96,7 @@ if __name__ == '__main__':
     except (EOFError, KeyboardInterrupt):
         node.stop()
         node.blockchain.save(filename or 'blockchain.json')
+
+        [exporter.stop() for exporter in exporters]
+        if profiler:
+            profiler.dump(args.profile)
@@ -0,0 +1,187 @@
+import logging
+from time import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Misbehavior scores, a peer reaching AdmissionControl.ban_score is disconnected
+RATE_LIMITED = 1  # sent faster than its rate limit
+MALFORMED = 10  # packet or message that can't be decoded/handled
+UNSOLICITED = 10  # response to a request we never sent
+INVALID = 50  # data an honest node never sends (eg: a header without Proof of Work, an invalid chain)
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` events per second on average and bursts of up to `burst` events
+    """
+
+    def __init__(self, rate, burst, now=None):
+        """
+        @param rate: <float> Tokens added per second
+        @param burst: <int> Maximum number of tokens
+        @param now: <time>
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time() if now is None else now
+
+    def consume(self, tokens=1, now=None):
+        """
+        @param tokens: <int> Cost of the event
+        @param now: <time>
+
+        @return: <bool> True if the event is allowed
+        """
+
+        now = time() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < tokens:
+            return False
+
+        self.tokens -= tokens
+        return True
+
+
+class AdmissionControl(object):
+    """
+    Decides which packets of a peer are worth handling
+
+    - Each peer has a token bucket per message type, packets over the rate limit are dropped
+    - Handshakes of unknown peers share a single token bucket
+    - Peers sending invalid or unsolicited data accumulate a misbehavior score,
+      once it reaches `ban_score` they are banned for `ban_time` seconds
+
+    Note: Peers are identified by the identifier they claim, which isn't authenticated
+    """
+
+    # Message type: (packets per second, burst)
+    limits = {
+        'version': (1, 10),
+        'getdata': (0.1, 2),  # answered with the whole blockchain
+        'getheaders': (1, 5),  # answered with every header
+        'headers': (1, 5),
+        'chain': (0.1, 2),
+        'getblocks': (20, 50),
+        'blocks': (20, 50),
+        'filterload': (0.1, 2),
+        'addtx': (100, 500),
+        'getwork': (50, 100),
+        'submit': (50, 100)
+    }
+    default_limit = (10, 50)
+
+    # Handshakes (version) of identifiers that aren't peers yet, all of them share a single bucket
+    handshake_limit = (10, 100)
+
+    def __init__(self, limits=None, default_limit=None, handshake_limit=None, ban_score=100, ban_time=60*60, max_peers=1024):
+        """
+        @param limits: <dict> Message type: (packets per second, burst), overriding the defaults
+        @param default_limit: (<float>, <int>) Limit of the other message types
+        @param handshake_limit: (<float>, <int>) Limit of the handshakes of unknown peers, all together
+        @param ban_score: <int> Misbehavior score at which a peer is banned
+        @param ban_time: <float> Seconds a banned peer is ignored for
+        @param max_peers: <int> Number of peers whose buckets and scores are remembered
+        """
+
+        self.limits = {**self.limits, **(limits or {})}
+        self.default_limit = default_limit or self.default_limit
+        self.ban_score = ban_score
+        self.ban_time = ban_time
+        self.max_peers = max_peers
+
+        self.buckets = OrderedDict()  # peer: {message type: <TokenBucket>}
+        self.scores = OrderedDict()  # peer: misbehavior score
+        self.bans = {}  # peer: time the ban ends
+        self.handshakes = TokenBucket(*(handshake_limit or self.handshake_limit))
+
+    def allow(self, peer, msg_type, now=None):
+        """
+        Take a token from the peer's bucket for this message type
+
+        @param peer: <str> Identifier of the peer
+        @param msg_type: <str>
+        @param now: <time>
+
+        @return: <bool> True if the packet is within the rate limit
+        """
+
+        if peer not in self.buckets:
+            self.buckets[peer] = {}
+            # Identifiers are free to make up, don't remember all of them
+            if len(self.buckets) > self.max_peers:
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(peer)
+
+        buckets = self.buckets[peer]
+        if msg_type not in buckets:
+            buckets[msg_type] = TokenBucket(*self.limits.get(msg_type, self.default_limit), now=now)
+
+        return buckets[msg_type].consume(now=now)
+
+    def allow_handshake(self, now=None):
+        """
+        Take a token from the bucket shared by the handshakes of unknown peers,
+        each made up identifier would get fresh buckets from allow
+
+        @param now: <time>
+
+        @return: <bool> True if the handshake is within the rate limit
+        """
+
+        return self.handshakes.consume(now=now)
+
+    def banned(self, peer, now=None):
+        """
+        @return: <bool> True if the peer is currently banned
+        """
+
+        if peer not in self.bans:
+            return False
+
+        now = time() if now is None else now
+        if now < self.bans[peer]:
+            return True
+
+        self.bans.pop(peer)
+        return False
+
+    def misbehaving(self, peer, score, reason='', now=None):
+        """
+        Add to the misbehavior score of a peer
+
+        @param peer: <str> Identifier of the peer
+        @param score: <int> Severity of the misbehavior
+        @param reason: <str> Logged description of the misbehavior
+        @param now: <time>
+
+        @return: <bool> True if the peer just got banned
+        """
+
+        self.scores[peer] = self.scores.get(peer, 0) + score
+        self.scores.move_to_end(peer)
+        if len(self.scores) > self.max_peers:
+            self.scores.popitem(last=False)
+
+        logger.debug('%s misbehaving (+%s = %s): %s', peer, score, self.scores[peer], reason)
+
+        if self.scores[peer] < self.ban_score:
+            return False
+
+        now = time() if now is None else now
+        self.bans[peer] = now + self.ban_time
+        if len(self.bans) > self.max_peers:
+            self.bans.pop(min(self.bans, key=self.bans.get))
+        self.forget(peer)
+
+        logger.warning(f'Banning {peer} for {self.ban_time} seconds: {reason}')
+        return True
+
+    def forget(self, peer):
+        self.buckets.pop(peer, None)
+        self.scores.pop(peer, None)
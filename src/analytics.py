@@ -0,0 +1,124 @@
+import numpy as np
+
+# Chain statistics computed on the columns of a blockchain (see columns.export_columns),
+# every function is a few whole-array operations instead of a loop over the blocks
+
+
+def block_intervals(columns, percentiles=(50, 90, 99), bins=20):
+    """
+    Distribution of the time between consecutive blocks
+
+    @param columns: <dict> Columns of the blockchain
+    @param percentiles: (<float>) Percentiles of the intervals to compute
+    @param bins: <int> Number of buckets of the histogram
+
+    @return: <dict> {count, mean, std, min, max, percentiles: {<p>: <seconds>}, histogram: {edges, counts}}
+    """
+
+    # The genesis block isn't mined, its timestamp says nothing about the next block
+    intervals = np.diff(columns['timestamp'][1:])
+    if len(intervals) == 0:
+        return {'count': 0}
+
+    counts, edges = np.histogram(intervals, bins=bins)
+
+    return {
+        'count': len(intervals),
+        'mean': float(intervals.mean()),
+        'std': float(intervals.std()),
+        'min': float(intervals.min()),
+        'max': float(intervals.max()),
+        'percentiles': dict(zip(percentiles, np.percentile(intervals, percentiles).tolist())),
+        'histogram': {'edges': edges.tolist(), 'counts': counts.tolist()}
+    }
+
+
+def miner_shares(columns, top=10):
+    """
+    Share of the reward transactions (blocks mined) of every miner
+
+    @param columns: <dict> Columns of the blockchain
+    @param top: <int> Number of miners returned
+
+    @return: [{address, blocks, rewards, share}] The miners with the most blocks first
+    """
+
+    reward = columns['reward']
+    recipients = columns['recipient'][reward]
+    if len(recipients) == 0:
+        return []
+
+    minlength = len(columns['addresses'])
+    blocks = np.bincount(recipients, minlength=minlength)
+    rewards = np.bincount(recipients, weights=columns['amount'][reward], minlength=minlength)
+
+    # Genesis reward of the reserved address isn't mined by anyone
+    codes = np.nonzero(columns['addresses'] == '0')[0]
+    blocks[codes] = 0
+
+    total = blocks.sum()
+    best = np.argsort(blocks, kind='stable')[::-1][:top]
+
+    return [
+        {
+            'address': str(columns['addresses'][code]),
+            'blocks': int(blocks[code]),
+            'rewards': float(rewards[code]),
+            'share': float(blocks[code] / total)
+        }
+        for code in best if blocks[code] > 0
+    ]
+
+
+def throughput(columns, window=60*60):
+    """
+    Transactions confirmed over time, rewards excluded
+
+    @param columns: <dict> Columns of the blockchain
+    @param window: <float> Seconds per bucket
+
+    @return: <dict> {start, window, txs: [<int>], volume: [<float>], txs_per_second: [<float>]}
+        One entry per bucket, from the time of the first block
+    """
+
+    timestamp = columns['timestamp']
+    if len(timestamp) == 0:
+        return {'start': None, 'window': window, 'txs': [], 'volume': [], 'txs_per_second': []}
+
+    start = timestamp.min()
+    buckets = int((timestamp.max() - start) // window) + 1
+
+    # Transactions count when their block was mined, not when they were signed
+    payments = ~columns['reward']
+    block_time = timestamp[np.searchsorted(columns['height'], columns['tx_height'][payments])]
+    bucket = ((block_time - start) // window).astype(np.int64)
+
+    txs = np.bincount(bucket, minlength=buckets)
+    volume = np.bincount(bucket, weights=columns['amount'][payments], minlength=buckets)
+
+    return {
+        'start': float(start),
+        'window': window,
+        'txs': txs.tolist(),
+        'volume': volume.tolist(),
+        'txs_per_second': (txs / window).tolist()
+    }
+
+
+def report(columns, top=10, window=60*60):
+    """
+    @return: <dict> Summary of the blockchain with all the statistics above
+    """
+
+    tx_count = columns['tx_count']
+
+    return {
+        'height': int(columns['height'].max(initial=0)),
+        'pruned_blocks': int((tx_count < 0).sum()),
+        'transactions': int((~columns['reward']).sum()),
+        'volume': float(columns['amount'][~columns['reward']].sum()),
+        'txs_per_block': float(tx_count[tx_count >= 0].mean()) if (tx_count >= 0).any() else 0.0,
+        'block_intervals': block_intervals(columns),
+        'miners': miner_shares(columns, top),
+        'throughput': throughput(columns, window)
+    }
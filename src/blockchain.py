@@ -1,24 +1,73 @@
 import json
 import math
+import logging
+import threading
 from time import time
 from hashlib import sha256
 
+from .signatures import SignatureVerifier
+
+
+logger = logging.getLogger(__name__)
+
 
 class Blockchain(object):
-    def __init__(self, chain=[], tx_info=None):
-        self.chain = chain
+    # Amount of the reward of a mined block, the only transaction sent by the reserved address '0'
+    # TODO: Change amount so it decreases over time
+    reward = 50
+
+    def __init__(self, chain=None, tx_info=None, pruned_height=0, verifier=None):
+        """
+        @param chain: [<block dict>] Blocks of the blockchain (default: only the genesis block)
+        @param tx_info: <dict> a mapping of transaction hashes to transaction information,
+                        or a function loading it the first time it is used (see storage.load_blockchain)
+        @param pruned_height: <int> Index up to which blocks only have their header
+        @param verifier: <SignatureVerifier> Verifies the signatures of transactions (default: a new one)
+        """
+
+        self.chain = chain if chain is not None else []
         self.transaction_pool = []
-        self.tx_info = tx_info or {'0': None}  # 0 is a reserved tx hash for rewards
+
+        self.tx_info_lock = threading.Lock()
+        if callable(tx_info):
+            self._tx_info = None
+            self.load_tx_info = tx_info
+        else:
+            self.tx_info = tx_info or {'0': None}  # 0 is a reserved tx hash for rewards
+
+        # Blocks up to this index only have their header (eg: loaded from a snapshot)
+        self.pruned_height = pruned_height
+
+        self.verifier = verifier or SignatureVerifier()
+
+        # Logs the changes of the transaction pool (see restore_pool)
+        self.journal = None
 
         # Create the genesis block
-        if len(chain) == 0:
-            self.verify_and_add_transaction('0', '0', 0, '0')
+        if len(self.chain) == 0:
+            self.add_reward('0', amount=0)
             self.add_block(previous_hash=1, proof=100)
 
     @property
     def last_block(self):
         return self.chain[-1]
 
+    @property
+    def tx_info(self):
+        # Loaded the first time it is used
+        if self.load_tx_info:
+            with self.tx_info_lock:
+                if self.load_tx_info:
+                    self._tx_info = self.load_tx_info()
+                    self.load_tx_info = None
+
+        return self._tx_info
+
+    @tx_info.setter
+    def tx_info(self, tx_info):
+        self._tx_info = tx_info
+        self.load_tx_info = None
+
     def add_block(self, proof, previous_hash=None):
         """
         Create new block in the Blockchain
@@ -56,10 +105,11 @@ class Blockchain(object):
 
         self.transaction_pool = []
         self.chain.append(block)
+        self.log_removed(block['transactions'])
 
         return block
 
-    def verify_and_add_transaction(self, sender, recipient, amount, previous_hash):
+    def verify_and_add_transaction(self, sender, recipient, amount, previous_hash, timestamp=None, signature=None):
         """
         Add a new transaction to the transaction pool.
 
@@ -70,6 +120,8 @@ class Blockchain(object):
         @param recipient: <str> Address of recipient
         @param amount: <int> Amount
         @param previous_hash: <str> hash of the previous transaction used
+        @param timestamp: <time> Time the transaction was signed at (default: now)
+        @param signature: <str> Signature of the transaction by the sender
 
         @return: <dict> transaction if it was successful, or None
         """
@@ -79,21 +131,124 @@ class Blockchain(object):
             'sender': sender,
             'recipient': recipient,
             'amount': amount,
-            'timestamp': time()
+            'timestamp': timestamp or time()
         }
 
+        if signature is not None:
+            tx['signature'] = signature
+
         if not self.valid_transaction(tx):
-            print('Invalid Transaction!')
+            logger.info('Invalid Transaction!')
             return None
 
-        # TxID = Double Hash of the Transaction
-        tx_hash = self.hash(self.hash(tx))
+        tx_hash = self.tx_hash(tx)
+
+        # Known before it's pending, a compaction of the journal might read the pool at any time
+        self.tx_info[tx_hash] = tx
+        self.transaction_pool.append(tx_hash)
+
+        if self.journal:
+            self.journal.add(tx_hash, tx)
+
+        return tx
+
+    def add_reward(self, recipient, amount=None):
+        """
+        Add the reward of the next block to the transaction pool, right before the block is created
+
+        Rewards are sent by the reserved address '0' and aren't signed, so they can't come from
+        verify_and_add_transaction. They are never pending, so they aren't journaled.
+
+        @param recipient: <str> Address of the miner
+        @param amount: <int> Amount (default: Blockchain.reward)
+
+        @return: <dict> transaction
+        """
+
+        tx = {
+            'previous_hash': '0',
+            'sender': '0',
+            'recipient': recipient,
+            'amount': self.reward if amount is None else amount,
+            'timestamp': time()
+        }
 
+        tx_hash = self.tx_hash(tx)
         self.transaction_pool.append(tx_hash)
         self.tx_info[tx_hash] = tx
 
         return tx
 
+    def remove_confirmed(self, blocks):
+        """
+        Remove the transactions of blocks added to the chain (eg: mined by a peer) from the transaction pool
+
+        @param blocks: [<block dict>]
+        """
+
+        confirmed = {tx_hash for block in blocks for tx_hash in block.get('transactions', [])}
+        removed = [tx_hash for tx_hash in self.transaction_pool if tx_hash in confirmed]
+
+        if removed:
+            self.transaction_pool = [tx_hash for tx_hash in self.transaction_pool if tx_hash not in confirmed]
+            self.log_removed(removed)
+
+    def log_removed(self, tx_hashes):
+        """
+        Journal transactions that left the transaction pool, compacting the journal once it's mostly obsolete
+
+        @param tx_hashes: [<str>]
+        """
+
+        if not self.journal:
+            return
+
+        self.journal.remove(tx_hashes)
+        if self.journal.should_compact(len(self.transaction_pool)):
+            self.journal.compact(lambda: {tx_hash: self.tx_info[tx_hash] for tx_hash in self.transaction_pool})
+
+    def restore_pool(self, journal, trusted=True):
+        """
+        Replay a journal of the transaction pool (eg: after a restart) and keep journaling to it
+
+        - Transactions already in the chain, or no longer valid on top of it, are dropped
+        - Signatures were verified before being journaled, like the transactions of our blockchain file
+          they are trusted unless `trusted` is False (then they are verified in one batch)
+
+        @param journal: <MempoolJournal>
+        @param trusted: <bool> Skip the verification of the signatures
+
+        @return: <int> Number of transactions put back in the pool
+        """
+
+        confirmed = {tx_hash for block in self.chain for tx_hash in block.get('transactions', [])}
+        confirmed.update(self.transaction_pool)
+
+        # Records that don't match their hash are corrupted, rewards are never pending
+        pending = [
+            (tx_hash, tx) for tx_hash, tx in journal.replay().items()
+            if tx_hash not in confirmed and isinstance(tx, dict) and tx.get('sender') != '0' and self.tx_hash(tx) == tx_hash
+        ]
+
+        # Valid signatures are cached, valid_transaction doesn't verify them again
+        if trusted:
+            self.verifier.trust(pending)
+        else:
+            self.verifier.verify_batch(pending)
+
+        restored = 0
+        for tx_hash, tx in pending:
+            # In order, a transaction can spend one that was pending before it
+            if self.valid_transaction(tx):
+                self.tx_info[tx_hash] = tx
+                self.transaction_pool.append(tx_hash)
+                restored += 1
+
+        self.journal = journal
+        journal.compact(lambda: {tx_hash: self.tx_info[tx_hash] for tx_hash in self.transaction_pool})
+
+        return restored
+
     def valid_transaction(self, transaction):
         """
         Determines whether a transaction is valid or not
@@ -115,38 +270,136 @@ class Blockchain(object):
         keys = ['sender', 'recipient', 'amount', 'previous_hash']
 
         for key in keys:
-            if key not in transaction:
+            if transaction.get(key) is None:
                 return False
 
+        # Rewards (sent by the reserved '0') are only created by add_reward
+        if transaction['sender'] == '0':
+            logger.info('Only a block\'s reward can be sent by 0')
+            return False
+
+        # Validate the signature
+        if not self.verifier.verify(self.tx_hash(transaction), transaction):
+            logger.info('Signature is not valid')
+            return False
+
         # Validate the transaction's previous_hash
         previous_hash = transaction['previous_hash']
 
-        # Ignore reserved '0'
+        # Only rewards create coins, everything else spends a previous transaction
         if previous_hash == '0':
-            return True
+            logger.info('Only a block\'s reward can have no previous transaction')
+            return False
 
         if previous_hash in self.tx_info:
             prev_tx = self.tx_info[previous_hash]
 
             if prev_tx['recipient'] != transaction['sender']:
-                print('Previous transaction\'s recipient is not the current sender')
+                logger.info('Previous transaction\'s recipient is not the current sender')
                 return False
 
             if prev_tx['amount'] < transaction['amount']:
-                print('Previous transaction\'s amount is not enough')
+                logger.info('Previous transaction\'s amount is not enough')
                 return False
         else:
-            print('Cannot find transaction with that hash')
+            logger.info('Cannot find transaction with that hash')
+            return False
+
+        return True
+
+    def verify_signatures(self, tx_info, blocks):
+        """
+        Verify the transactions received from a peer along with blocks, signatures in one batch
+
+        - Every block (but pruned ones) has exactly one unsigned reward of Blockchain.reward (0 for the genesis block)
+        - Rewards that aren't the reward of one of the blocks (eg: of a fork the peer left) are removed from tx_info,
+          nobody could spend them otherwise
+        - Every other transaction is signed by its sender
+
+        @param tx_info: <dict> a mapping of transaction hashes to transaction information
+        @param blocks: [<dict>] Blocks received with the transactions
+
+        @return: <bool> True if every transaction matches its hash and is signed by its sender
+        """
+
+        if not self.valid_rewards(blocks, tx_info):
+            return False
+
+        referenced = {tx_hash for block in blocks for tx_hash in block.get('transactions', [])}
+
+        signed = []
+        for tx_hash, tx in list(tx_info.items()):
+            if tx is None:
+                continue
+
+            if self.tx_hash(tx) != tx_hash:
+                logger.warning(f'Transaction doesn\'t match its hash {tx_hash}')
+                return False
+
+            if tx.get('sender') != '0':
+                signed.append((tx_hash, tx))
+            elif tx_hash not in referenced:
+                tx_info.pop(tx_hash)
+
+        if not all(self.verifier.verify_batch(signed)):
+            logger.warning('Signature is not valid')
             return False
 
         return True
 
+    def prune(self, depth):
+        """
+        Throw away the bodies of blocks older than `depth` blocks and their spent transactions
+
+        - Headers are kept so the chain can still be validated and served
+        - Transactions no block spent yet are kept so they can still be spent
+
+        @param depth: <int> Number of most recent blocks to keep whole
+
+        @return: <int> Number of blocks that were pruned
+        """
+
+        prune_to = len(self.chain) - depth
+        if prune_to <= self.pruned_height:
+            return 0
+
+        # Only spends confirmed in a block count, transactions of the pool may never be mined
+        spent = set()
+        for block in self.chain[self.pruned_height:]:
+            for tx_hash in block.get('transactions', []):
+                tx = self.tx_info.get(tx_hash)
+                if tx:
+                    spent.add(tx['previous_hash'])
+
+        for i in range(self.pruned_height, prune_to):
+            block = self.chain[i]
+            for tx_hash in block.get('transactions', []):
+                tx = self.tx_info.get(tx_hash)
+
+                # What it spends was kept while unspent, even if its own block is already pruned
+                if tx and tx['previous_hash'] != '0':
+                    self.tx_info.pop(tx['previous_hash'], None)
+
+                if tx_hash in spent:
+                    self.tx_info.pop(tx_hash, None)
+
+            self.chain[i] = {'header': block['header']}
+
+        pruned = prune_to - self.pruned_height
+        self.pruned_height = prune_to
+
+        return pruned
+
     def save(self, filename='blockchain.json'):
+        # tx_info might still have to be loaded from the file we're about to overwrite
+        data = {
+            'pruned_height': self.pruned_height,
+            'chain': self.chain,
+            'tx_info': self.tx_info
+        }
+
         with open(filename, 'w') as outfile:
-            json.dump({
-                'chain': self.chain,
-                'tx_info': self.tx_info,
-            }, outfile, indent=4)
+            json.dump(data, outfile, indent=4)
 
     @staticmethod
     def hash(_dict):
@@ -162,6 +415,19 @@ class Blockchain(object):
         dict_str = json.dumps(_dict, sort_keys=True).encode()
         return sha256(dict_str).hexdigest()
 
+    @staticmethod
+    def tx_hash(tx):
+        """
+        TxID = Double Hash of the Transaction, without its signature
+
+        @param tx: <dict> Transaction
+
+        @return: <str>
+        """
+
+        unsigned = {key: value for key, value in tx.items() if key != 'signature'}
+        return Blockchain.hash(Blockchain.hash(unsigned))
+
     @staticmethod
     def find_merkle(tx_list, tx_info):
         """
@@ -189,8 +455,8 @@ class Blockchain(object):
 
         tree[-1] = tx_list.copy()
 
-        # Go from leaf level (tree_height - 1) to root (0)
-        for i in range(tree_height - 1, -1, -1):
+        # Go from leaf level (tree_height - 1) up to the root (0)
+        for i in range(tree_height - 1, 0, -1):
             current_level = tree[i]
             next_level = []
 
@@ -200,18 +466,86 @@ class Blockchain(object):
 
             for t in range(0, len(current_level), 2):
                 str_to_hash = f'{current_level[t]}{current_level[t+1]}'
-                next_level.append(sha256(sha256(str_to_hash.encode())))
+                next_level.append(sha256(sha256(str_to_hash.encode()).digest()).hexdigest())
 
-            tree[i] = next_level
+            tree[i-1] = next_level
         return tree
 
     @staticmethod
-    def valid_proof(prev_hash, proof):
+    def merkle_path(tree, tx_hash):
+        """
+        Finds the path proving that a transaction is part of a Merkle Tree
+
+        @param tree: [[<transaction hashes>]] Merkle Tree given by find_merkle
+        @param tx_hash: <str> Hash of the transaction
+
+        @return: [[<str>, <str>]] (sibling hash, 'left'/'right' side of the sibling) from the leaf up to the root,
+                 or None if the transaction isn't in the tree
+        """
+
+        if tx_hash not in tree[-1]:
+            return None
+
+        path = []
+        position = tree[-1].index(tx_hash)
+
+        # Go from leaf level up to the level under the root
+        for level in reversed(tree[1:]):
+            if position % 2 == 0:
+                path.append([level[position + 1], 'right'])
+            else:
+                path.append([level[position - 1], 'left'])
+            position //= 2
+
+        return path
+
+    @staticmethod
+    def valid_merkle_path(tx_hash, path, merkleroot):
+        """
+        Determines whether a Merkle path leads from a transaction to a Merkle root
+
+        @param tx_hash: <str> Hash of the transaction
+        @param path: [[<str>, <str>]] Merkle path given by merkle_path
+        @param merkleroot: <str> Merkle root of a block header
+
+        @return: <bool> True if the transaction is part of the block
+        """
+
+        current = tx_hash
+        for sibling, side in path:
+            str_to_hash = f'{sibling}{current}' if side == 'left' else f'{current}{sibling}'
+            current = sha256(sha256(str_to_hash.encode()).digest()).hexdigest()
+
+        return current == merkleroot
+
+    @staticmethod
+    def valid_header_proof(header, assume_valid=0):
+        """
+        Cheap check of a single header's Proof of Work, before validating the chain it belongs to
+
+        @param header: <dict> Block header
+        @param assume_valid: <int> Index up to which Proof of Work is assumed valid
+
+        @return: <bool>
+        """
+
+        if not isinstance(header, dict) or not isinstance(header.get('index'), int):
+            return False
+
+        # The genesis block has no Proof of Work
+        if header['index'] <= max(assume_valid, 1):
+            return True
+
+        return Blockchain.valid_proof(header.get('previous_hash'), header.get('proof'))
+
+    @staticmethod
+    def valid_proof(prev_hash, proof, difficulty=4):
         """
         Determines if it is a valid proof of work
 
         @param prev_hash: <str>
         @param proof: <int>
+        @param difficulty: <int> Number of leading zeros (lower than 4 for mining pool shares)
 
         @return: <bool> T/F depending on whether the hash fits the criteria
         """
@@ -220,10 +554,10 @@ class Blockchain(object):
         guess_hash = sha256(guess).hexdigest()
 
         # TODO: Change the criteria
-        return guess_hash[:4] == "0" * 4
+        return guess_hash[:difficulty] == "0" * difficulty
 
     @staticmethod
-    def valid_chain(chain):
+    def valid_chain(chain, assume_valid=0):
         """
         Determines whether a blockchain is valid or not
 
@@ -233,42 +567,72 @@ class Blockchain(object):
         - Proof of Work is correct for each block in the sequence
 
         @param chain: [<block dict>] A blockchain
+        @param assume_valid: <int> Index of a checkpointed block, Proof of Work is not verified up to it
 
         @return <bool> True/False depending on whether the blockchain is valid
         """
 
-        for i in range(0, len(chain)-1):
-            block = chain[i]
-            next_block = chain[i+1]
+        return Blockchain.valid_headers([block['header'] for block in chain], assume_valid)
 
-            if block['header']['index'] != i+1 or next_block['header']['index'] != i+2:
-                print('Indices aren\'t correct')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
-                return False
+    @classmethod
+    def valid_rewards(cls, blocks, tx_info):
+        """
+        Determines whether every block has exactly one reward of the right amount
 
-            if block['header']['timestamp'] > next_block['header']['timestamp']:
-                print('Timestamps aren\'t ordered!')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
-                return False
+        @param blocks: [<dict>] Blocks
+        @param tx_info: <dict> a mapping of transaction hashes to transaction information
 
-            if Blockchain.hash(block['header']) != next_block['header']['previous_hash']:
-                print('Hashes aren\'t correct!')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
-                return False
+        @return <bool>
+        """
 
-            if not Blockchain.valid_proof(Blockchain.hash(block['header']), next_block['header']['proof']):
-                print('Proof of Work is not valid!')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
+        for block in blocks:
+            # Pruned blocks only have their header
+            if 'transactions' not in block:
+                continue
+
+            rewards = [tx_info.get(tx_hash) for tx_hash in block['transactions']]
+            rewards = [tx for tx in rewards if tx and tx.get('sender') == '0']
+
+            amount = 0 if block['header']['index'] == 1 else cls.reward
+            if len(rewards) != 1 or rewards[0].get('amount') != amount or rewards[0].get('previous_hash') != '0':
+                logger.warning(f'Block {block["header"]["index"]} doesn\'t have exactly one reward of {amount}')
                 return False
 
         return True
 
     @staticmethod
-    def valid_headers(headers):
+    def valid_block(block, header, tx_info):
+        """
+        Determines whether a block's body matches an already verified header
+
+        It needs to verify two things:
+        - The block's header is the verified header
+        - The merkle root of the block's transactions is the one in the header
+
+        @param block: <dict> Block
+        @param header: <dict> Verified block header
+        @param tx_info: <dict> a mapping of transaction hashes to transaction information
+
+        @return <bool> True/False depending on whether the block is valid
+        """
+
+        if Blockchain.hash(block['header']) != Blockchain.hash(header):
+            logger.warning('Block doesn\'t match its header!')
+            return False
+
+        transactions = block.get('transactions')
+        if not transactions or any(tx_hash not in tx_info for tx_hash in transactions):
+            logger.warning('Block is missing transactions!')
+            return False
+
+        if Blockchain.find_merkle(transactions, tx_info)[0][0] != header['merkleroot']:
+            logger.warning('Merkle root is not valid!')
+            return False
+
+        return True
+
+    @staticmethod
+    def valid_headers(headers, assume_valid=0):
         """
         Determines whether a blockchain is valid or not
 
@@ -278,36 +642,75 @@ class Blockchain(object):
         - Proof of Work is correct for each block in the sequence
 
         @param headers: [<block dict>] Block headers
+        @param assume_valid: <int> Index of a checkpointed block, Proof of Work is not verified up to it
 
         @return <bool> True/False depending on whether the blockchain is valid
         """
 
-        for i in range(0, len(headers)-1):
-            block = headers[i]
-            next_block = headers[i+1]
+        if headers and headers[0]['index'] != 1:
+            logger.warning('Indices aren\'t correct')
+            return False
 
-            if block['index'] != i+1 or next_block['index'] != i+2:
-                print('Indices aren\'t correct')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
+        for i in range(0, len(headers)-1):
+            if not Blockchain.valid_next_header(headers[i], headers[i+1], verify_proof=i+2 > assume_valid):
                 return False
 
-            if block['timestamp'] > next_block['timestamp']:
-                print('Timestamps aren\'t ordered!')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
-                return False
+        return True
 
-            if Blockchain.hash(block) != next_block['previous_hash']:
-                print('Hashes aren\'t correct!')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
-                return False
+    @staticmethod
+    def valid_next_header(header, next_header, verify_proof=True):
+        """
+        Determines whether a block header can follow another one (eg: a new block on top of our tip)
+
+        It needs to verify three things:
+        - The index follows and the timestamp isn't older
+        - The previous_hash matches the hash of the header
+        - Proof of Work is correct
+
+        @param header: <dict> Block header
+        @param next_header: <dict> Block header following it
+        @param verify_proof: <bool> False if the Proof of Work is assumed valid (eg: up to a checkpoint)
+
+        @return <bool>
+        """
+
+        if next_header['index'] != header['index'] + 1:
+            logger.warning('Indices aren\'t correct')
+            logger.debug('Block: %s\nNext: %s', header, next_header)
+            return False
+
+        if header['timestamp'] > next_header['timestamp']:
+            logger.warning('Timestamps aren\'t ordered!')
+            logger.debug('Block: %s\nNext: %s', header, next_header)
+            return False
+
+        header_hash = Blockchain.hash(header)
+        if header_hash != next_header['previous_hash']:
+            logger.warning('Hashes aren\'t correct!')
+            logger.debug('Block: %s\nNext: %s', header, next_header)
+            return False
+
+        if verify_proof and not Blockchain.valid_proof(header_hash, next_header['proof']):
+            logger.warning('Proof of Work is not valid!')
+            logger.debug('Block: %s\nNext: %s', header, next_header)
+            return False
+
+        return True
+
+    @staticmethod
+    def matches_checkpoints(headers, checkpoints):
+        """
+        Determines whether block headers agree with every checkpoint they reach
+
+        @param headers: [<block dict>] Block headers
+        @param checkpoints: <dict> Block index: hash of the block's header
+
+        @return <bool> True/False depending on whether the headers match the checkpoints
+        """
 
-            if not Blockchain.valid_proof(Blockchain.hash(block), next_block['proof']):
-                print('Proof of Work is not valid!')
-                print(f'Block: {block}')
-                print(f'Next: {next_block}')
+        for index, block_hash in checkpoints.items():
+            if index <= len(headers) and Blockchain.hash(headers[index - 1]) != block_hash:
+                logger.warning(f'Block {index} doesn\'t match its checkpoint!')
                 return False
 
         return True
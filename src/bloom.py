@@ -0,0 +1,93 @@
+import math
+from hashlib import sha256
+
+
+# Same limits as Bitcoin's BIP 37 so a peer can't make us store or hash too much
+MAX_FILTER_SIZE = 36000 * 8  # bits
+MAX_HASH_FUNCS = 50
+
+
+class BloomFilter(object):
+    """
+    Probabilistic set of the items (addresses, transaction hashes) an SPV node is interested in
+
+    - No false negatives: every added item is always matched
+    - Some false positives: unrelated items are matched with a small probability,
+      which hides exactly which items the SPV node cares about
+    """
+
+    def __init__(self, size=1024, hashes=5, tweak=0, bits=None):
+        """
+        @param size: <int> Number of bits in the filter
+        @param hashes: <int> Number of hash functions
+        @param tweak: <int> Seed of the hash functions
+        @param bits: <bytes> Content of the filter (default: empty)
+        """
+
+        if not 0 < size <= MAX_FILTER_SIZE or not 0 < hashes <= MAX_HASH_FUNCS:
+            raise ValueError(f'Bloom filter of {size} bits and {hashes} hashes is too large')
+
+        self.size = size
+        self.hashes = hashes
+        self.tweak = tweak
+        self.bits = bytearray(bits) if bits else bytearray(math.ceil(size / 8))
+
+        if len(self.bits) != math.ceil(size / 8):
+            raise ValueError('Bloom filter bits don\'t match its size')
+
+    @classmethod
+    def optimal(cls, items, fp_rate=0.0001, tweak=0):
+        """
+        Create a filter sized for a number of items and a false positive rate
+
+        @param items: <int> Expected number of items
+        @param fp_rate: <float> Wanted false positive rate
+
+        @return: <BloomFilter>
+        """
+
+        items = max(items, 1)
+        size = math.ceil(-items * math.log(fp_rate) / math.log(2) ** 2)
+        size = min(max(size, 8), MAX_FILTER_SIZE)
+        hashes = min(max(round(size / items * math.log(2)), 1), MAX_HASH_FUNCS)
+
+        return cls(size, hashes, tweak)
+
+    def positions(self, item):
+        # Double hashing: h1 + i * h2 simulates `hashes` independent hash functions
+        digest = sha256(f'{self.tweak}:{item}'.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big')
+
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self.positions(item))
+
+    def matches(self, tx_hash, tx):
+        """
+        Determines whether a transaction concerns the filter
+
+        @param tx_hash: <str> Hash of the transaction
+        @param tx: <dict> Transaction
+
+        @return: <bool> True if the transaction, its sender, its recipient or the transaction it spends is in the filter
+        """
+
+        return tx_hash in self or any(tx[key] in self for key in ('sender', 'recipient', 'previous_hash'))
+
+    def to_dict(self):
+        return {
+            'size': self.size,
+            'hashes': self.hashes,
+            'tweak': self.tweak,
+            'bits': self.bits.hex()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['size'], data['hashes'], data['tweak'], bytes.fromhex(data['bits']))
@@ -0,0 +1,288 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+def same(a, b):
+    """
+    @return: <bool> True if a and b are the same objects (element-wise for tuples, by value for numbers)
+    """
+
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        return len(a) == len(b) and all(map(same, a, b))
+
+    return a is b or (isinstance(a, int) and isinstance(b, int) and a == b)
+
+
+class LRUCache(object):
+    """
+    Bounded mapping evicting the least recently used entries
+
+    Every value remembers the objects it was computed from (its source), a value is only
+    a hit while the source is still the very same objects (eg: the block at a height wasn't replaced)
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        @param maxsize: <int> Number of entries kept
+        """
+
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key: (source, value)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, source):
+        """
+        @param key: Key of the entry
+        @param source: Object (or tuple of objects) the value has to be computed from
+
+        @return: The cached value, or None
+        """
+
+        entry = self.entries.get(key)
+        if entry is None or not same(entry[0], source):
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, source, value):
+        self.entries[key] = (source, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def discard(self, keys):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        """
+        @return: <dict> {size, hits, misses, hit_rate}
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class BlockCache(object):
+    """
+    Read layer over the blocks, headers and transactions of a blockchain, serving peers from memory
+
+    - Blocks (by height) and transactions (by hash) are kept in LRU caches along with their JSON encoding,
+      so hot items such as the latest blocks every syncing peer asks for are encoded only once
+    - The encoded headers of the whole chain are kept in order
+    - Whole responses (getheaders, getdata, windows of getblocks) are reused until what they are made of changes
+    - Blocks replaced since they were cached (reorg, pruning) are new objects, so their entries are misses,
+      reorg() also drops them right away
+
+    Responses are built from the encoded pieces and are the same JSON as json.dumps of the whole message
+    """
+
+    def __init__(self, blockchain, max_blocks=1024, max_txs=16384, max_responses=64):
+        """
+        @param blockchain: <Blockchain>
+        @param max_blocks: <int> Number of encoded blocks kept
+        @param max_txs: <int> Number of encoded transactions kept
+        @param max_responses: <int> Number of encoded responses kept
+        """
+
+        self.blockchain = blockchain
+
+        self.blocks = LRUCache(max_blocks)  # height: encoded block
+        self.txs = LRUCache(max_txs)  # tx hash: encoded transaction
+
+        self.headers = []  # [(header, encoded header)] of the chain, in order
+        self.version = 0  # changes whenever the headers do
+
+        self.responses = LRUCache(max_responses)  # type (and request): encoded response
+
+        self.lock = threading.RLock()
+
+    def sync_headers(self):
+        """
+        Bring the encoded headers up to date with the chain
+
+        Blocks before a fork are the same objects in the new chain, only the headers after the first replaced one are encoded
+        """
+
+        chain = self.blockchain.chain
+
+        # Binary search for the first replaced header
+        low, high = 0, min(len(self.headers), len(chain))
+        while low < high:
+            mid = (low + high) // 2
+            if self.headers[mid][0] is chain[mid]['header']:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < len(self.headers):
+            self.truncate(low)
+
+        for block in chain[len(self.headers):]:
+            header = block['header']
+            self.headers.append((header, json.dumps(header, sort_keys=True)))
+            self.version += 1
+
+    def truncate(self, length):
+        del self.headers[length:]
+        self.version += 1
+
+    def reorg(self, height):
+        """
+        Drop everything cached about the blocks from a height on (eg: they were replaced by a fork)
+
+        @param height: <int> Index of the first replaced block
+        """
+
+        with self.lock:
+            self.truncate(min(len(self.headers), max(0, height - 1)))
+            self.blocks.discard([key for key in self.blocks.entries if key >= height])
+            self.responses.clear()
+
+    def block(self, height):
+        chain = self.blockchain.chain
+        return chain[height - 1] if 0 < height <= len(chain) else None
+
+    # Wire encoding
+    def encoded_block(self, height):
+        """
+        @return: <str> JSON of the block at a height, or None
+        """
+
+        block = self.block(height)
+        if block is None:
+            return None
+
+        with self.lock:
+            encoded = self.blocks.get(height, block)
+            if encoded is None:
+                encoded = json.dumps(block)
+                self.blocks.put(height, block, encoded)
+
+        return encoded
+
+    def encoded_tx(self, tx_hash):
+        """
+        @return: <str> JSON of a transaction ('null' if unknown)
+        """
+
+        tx = self.blockchain.tx_info.get(tx_hash)
+
+        with self.lock:
+            encoded = self.txs.get(tx_hash, tx)
+            if encoded is None:
+                encoded = json.dumps(tx)
+                self.txs.put(tx_hash, tx, encoded)
+
+        return encoded
+
+    def encoded_tx_info(self, blocks):
+        """
+        @param blocks: [<dict>] Blocks whose transactions are encoded
+
+        @return: <str> JSON of the mapping of the blocks' transaction hashes to their transaction
+        """
+
+        tx_hashes = dict.fromkeys(tx_hash for block in blocks for tx_hash in block.get('transactions', []))
+        return '{' + ', '.join(f'{json.dumps(tx_hash)}: {self.encoded_tx(tx_hash)}' for tx_hash in tx_hashes) + '}'
+
+    def response(self, key, source, build):
+        """
+        @param key: Type of the response (and what was requested)
+        @param source: <tuple> What the response is made of, it's reused while they are the same (see same)
+        @param build: <function> Encodes the response
+
+        @return: <str>
+        """
+
+        with self.lock:
+            encoded = self.responses.get(key, source)
+            if encoded is None:
+                encoded = build()
+                self.responses.put(key, source, encoded)
+
+        return encoded
+
+    def headers_message(self):
+        """
+        @return: <str> Message of a headers response (every header of the chain)
+        """
+
+        with self.lock:
+            self.sync_headers()
+            return self.response('headers', (self.version,), lambda: '{"headers": [' + ', '.join(
+                encoded for _, encoded in self.headers
+            ) + ']}')
+
+    def chain_message(self):
+        """
+        @return: <str> Message of a chain response (the whole blockchain)
+        """
+
+        tx_info = self.blockchain.tx_info
+
+        with self.lock:
+            self.sync_headers()
+
+            # Transactions are only ever added to tx_info (besides pruning, which replaces blocks) or it's replaced whole
+            return self.response('chain', (self.version, tx_info, len(tx_info)), lambda: json.dumps({
+                'chain': self.blockchain.chain,
+                'tx_info': tx_info
+            }))
+
+    def blocks_message(self, request, indices):
+        """
+        @param request: <int> Id of the getblocks request
+        @param indices: [<int>] Indices of the blocks to send (the ones out of the chain are skipped)
+
+        @return: <str> Message of a blocks response
+        """
+
+        heights = tuple(index for index in indices if self.block(index) is not None)
+        blocks = tuple(self.block(height) for height in heights)
+
+        # Syncing peers ask for the same windows of blocks, only the id of the request differs
+        body = self.response(('blocks', heights), blocks, lambda: '"blocks": [%s], "tx_info": %s}' % (
+            ', '.join(self.encoded_block(height) for height in heights),
+            self.encoded_tx_info(blocks)
+        ))
+
+        return '{"request": %s, %s' % (json.dumps(request), body)
+
+    def addblock_message(self, height):
+        """
+        @param height: <int> Index of a new block
+
+        @return: <str> Message announcing the block with its transactions
+        """
+
+        return '{"block": %s, "tx_info": %s, "height": %d}' % (
+            self.encoded_block(height),
+            self.encoded_tx_info([self.block(height)]),
+            len(self.blockchain.chain)
+        )
+
+    def stats(self):
+        """
+        @return: <dict> Statistics of every cache: {blocks, txs, responses}
+        """
+
+        return {
+            'blocks': self.blocks.stats(),
+            'txs': self.txs.stats(),
+            'responses': self.responses.stats()
+        }
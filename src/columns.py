@@ -0,0 +1,88 @@
+import numpy as np
+
+
+def export_columns(blockchain):
+    """
+    Turn the blocks and confirmed transactions of a blockchain into columns (one array per field)
+
+    - Addresses are dictionary encoded: the columns hold indices into `addresses`
+    - Pruned blocks have a `tx_count` of -1, their transactions are gone
+
+    @param blockchain: <Blockchain>
+
+    @return: <dict>
+        Columns of format: {
+            height: <int64 array>  # index of every block
+            timestamp: <float64 array>
+            proof: <int64 array>
+            tx_count: <int64 array>
+            tx_height: <int64 array>  # index of the block of every transaction
+            tx_timestamp: <float64 array>
+            amount: <float64 array>
+            sender: <int64 array>  # index in addresses
+            recipient: <int64 array>  # index in addresses
+            reward: <bool array>  # sent by the reserved address '0'
+            addresses: <str array>
+        }
+    """
+
+    height, timestamp, proof, tx_count = [], [], [], []
+    tx_height, tx_timestamp, amount, sender, recipient = [], [], [], [], []
+    codes = {}  # address: index in addresses
+
+    tx_info = blockchain.tx_info
+    for block in blockchain.chain:
+        header = block['header']
+        height.append(header['index'])
+        timestamp.append(header['timestamp'])
+        proof.append(header['proof'])
+
+        if 'transactions' not in block:
+            tx_count.append(-1)
+            continue
+
+        tx_count.append(len(block['transactions']))
+        for tx_hash in block['transactions']:
+            tx = tx_info.get(tx_hash)
+            if not tx:
+                continue
+
+            tx_height.append(header['index'])
+            tx_timestamp.append(tx.get('timestamp') or header['timestamp'])
+            amount.append(tx['amount'])
+            sender.append(codes.setdefault(tx['sender'], len(codes)))
+            recipient.append(codes.setdefault(tx['recipient'], len(codes)))
+
+    sender = np.array(sender, dtype=np.int64)
+
+    return {
+        'height': np.array(height, dtype=np.int64),
+        'timestamp': np.array(timestamp, dtype=np.float64),
+        'proof': np.array(proof, dtype=np.int64),
+        'tx_count': np.array(tx_count, dtype=np.int64),
+        'tx_height': np.array(tx_height, dtype=np.int64),
+        'tx_timestamp': np.array(tx_timestamp, dtype=np.float64),
+        'amount': np.array(amount, dtype=np.float64),
+        'sender': sender,
+        'recipient': np.array(recipient, dtype=np.int64),
+        'reward': sender == codes.get('0', -1),
+        'addresses': np.array(list(codes), dtype=str)
+    }
+
+
+def save_columns(columns, filename='chain.npz'):
+    """
+    Save columns in one uncompressed NumPy archive, loading it back is a copy of each array
+    """
+
+    with open(filename, 'wb') as outfile:
+        np.savez(outfile, **columns)
+
+
+def load_columns(filename='chain.npz'):
+    """
+    @return: <dict> Columns saved with save_columns
+    """
+
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
@@ -0,0 +1,127 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class MempoolJournal(object):
+    """
+    Append-only log of the transaction pool, so pending transactions survive a restart
+
+    Every line is a JSON record:
+    - {"add": <tx hash>, "tx": <transaction>} when a transaction enters the pool
+    - {"remove": [<tx hashes>]} when transactions leave it (mined, or confirmed by a peer's block)
+
+    Replaying the records in order gives back the pool. Once most records are obsolete
+    the log is compacted: rewritten with only the pending transactions.
+    """
+
+    def __init__(self, filename='mempool.log', fsync=False, compact_ratio=4, min_compact=1000):
+        """
+        @param filename: <str> File of the journal
+        @param fsync: <bool> Flush every record to the disk, not only to the OS (survives power failures, not just crashes)
+        @param compact_ratio: <int> Compact once there are this many times more records than pending transactions
+        @param min_compact: <int> Never compact a journal with fewer records
+        """
+
+        self.filename = filename
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio
+        self.min_compact = min_compact
+
+        self.records = 0  # records in the file
+        self.lock = threading.Lock()
+        self.outfile = None
+
+    def replay(self):
+        """
+        Read the journal
+
+        @return: <dict> Pending transactions in the order they entered the pool, {<tx hash>: <transaction>}
+        """
+
+        pending = {}
+        self.records = 0
+
+        try:
+            with open(self.filename) as infile:
+                for line in infile:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last write of a crash
+                        logger.warning(f'Skipping a corrupted record of {self.filename}')
+                        continue
+
+                    self.records += 1
+                    if 'add' in record:
+                        pending[record['add']] = record.get('tx')
+                    else:
+                        for tx_hash in record.get('remove', []):
+                            pending.pop(tx_hash, None)
+        except FileNotFoundError:
+            pass
+
+        return pending
+
+    def write(self, *records):
+        with self.lock:
+            if self.outfile is None:
+                self.outfile = open(self.filename, 'a')
+
+            self.outfile.write(''.join(json.dumps(record) + '\n' for record in records))
+            self.outfile.flush()
+            if self.fsync:
+                os.fsync(self.outfile.fileno())
+
+            self.records += len(records)
+
+    def add(self, tx_hash, tx):
+        self.write({'add': tx_hash, 'tx': tx})
+
+    def remove(self, tx_hashes):
+        if tx_hashes:
+            self.write({'remove': list(tx_hashes)})
+
+    def should_compact(self, pending):
+        """
+        @param pending: <int> Number of pending transactions
+
+        @return: <bool> True if the journal is mostly made of obsolete records
+        """
+
+        return self.records >= max(self.min_compact, self.compact_ratio * pending)
+
+    def compact(self, pending):
+        """
+        Rewrite the journal with only the pending transactions
+
+        @param pending: <function> Returns the pending transactions, {<tx hash>: <transaction>} in the order they entered the pool
+            It's called while holding the lock, so a transaction added meanwhile is either in it or written after the rewrite
+        """
+
+        with self.lock:
+            pending = pending()
+            data = ''.join(json.dumps({'add': tx_hash, 'tx': tx}) + '\n' for tx_hash, tx in pending.items())
+
+            # Write then rename so a crash never loses the pending transactions
+            tmp = f'{self.filename}.tmp'
+            with open(tmp, 'w') as outfile:
+                outfile.write(data)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+            if self.outfile is not None:
+                self.outfile.close()
+                self.outfile = None
+
+            os.replace(tmp, self.filename)
+            self.records = len(pending)
+
+    def close(self):
+        with self.lock:
+            if self.outfile is not None:
+                self.outfile.close()
+                self.outfile = None
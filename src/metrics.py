@@ -0,0 +1,294 @@
+import os
+import json
+import pstats
+import cProfile
+import threading
+from io import StringIO
+from time import time, sleep, perf_counter
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {
+            'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts)),
+            'sum': self.sum,
+            'count': self.count
+        }
+
+
+class Metrics(object):
+    """
+    Counters, gauges and latency histograms of a node
+
+    Every metric is identified by its name and its labels, for example:
+        metrics.inc('messages_received', type='addblock')
+        metrics.set('mempool_size', 12)
+
+        with metrics.timer('handle_seconds', type='addblock'):
+            ...
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """
+        @return: The value of a counter or gauge, the snapshot of a histogram or None
+        """
+
+        key = self.key(name, labels)
+        with self.lock:
+            if key in self.histograms:
+                return self.histograms[key].snapshot()
+            return self.counters.get(key, self.gauges.get(key))
+
+    def snapshot(self):
+        """
+        @return: <dict> of format: {
+            timestamp: <time>
+            counters: [{name: <str>, labels: <dict>, value: <int>}]
+            gauges: [{name: <str>, labels: <dict>, value: <float>}]
+            histograms: [{name: <str>, labels: <dict>, buckets: <dict>, sum: <float>, count: <int>}]
+        }
+        """
+
+        with self.lock:
+            return {
+                'timestamp': time(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in self.gauges.items()],
+                'histograms': [{'name': name, 'labels': dict(labels), **histogram.snapshot()}
+                               for (name, labels), histogram in self.histograms.items()]
+            }
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text format
+
+        @return: <str>
+        """
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def series(name, labels, extra=()):
+            pairs = [*labels, *extra]
+            if not pairs:
+                return name
+            return name + '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f'{series(name, labels)} {value}')
+
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f'{series(name, labels)} {value}')
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.buckets), '+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{series(name + "_bucket", labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{series(name + "_sum", labels)} {histogram.sum}')
+                lines.append(f'{series(name + "_count", labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class HTTPExporter(threading.Thread):
+    """
+    Serves the metrics in the Prometheus text format at http://<host>:<port>/metrics
+    """
+
+    def __init__(self, metrics, port=9100, host=''):
+        threading.Thread.__init__(self, daemon=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SnapshotExporter(threading.Thread):
+    """
+    Periodically writes a JSON snapshot of the metrics to a file
+    """
+
+    def __init__(self, metrics, filename='metrics.json', interval=10):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self.keep_running = True
+        self.lock = threading.Lock()
+
+    def run(self):
+        while self.keep_running:
+            sleep(self.interval)
+            self.write()
+
+    def write(self):
+        # Write to a temporary file first so readers never see a partial snapshot
+        with self.lock:
+            with open(f'{self.filename}.tmp', 'w') as outfile:
+                json.dump(self.metrics.snapshot(), outfile, indent=4)
+            os.replace(f'{self.filename}.tmp', self.filename)
+
+    def stop(self):
+        self.keep_running = False
+        self.write()
+
+
+class SamplingProfiler(object):
+    """
+    Opt-in profiler which runs cProfile on one out of every `every` calls
+    and accumulates the results, so it can stay enabled on hot paths
+    """
+
+    def __init__(self, every=100):
+        self.every = every
+        self.calls = 0
+        self.stats = None
+        self.lock = threading.Lock()
+
+    def profile(self, func, *args, **kwargs):
+        self.calls += 1
+        if self.calls % self.every != 0:
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active (only one at a time on newer Pythons)
+            return func(*args, **kwargs)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profiler)
+                else:
+                    self.stats.add(profiler)
+
+    def report(self, limit=20, sort='cumulative'):
+        """
+        @return: <str> The `limit` most expensive functions of the sampled calls
+        """
+
+        with self.lock:
+            if self.stats is None:
+                return ''
+
+            stream = StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats(sort).print_stats(limit)
+            return stream.getvalue()
+
+    def dump(self, filename):
+        """
+        Write the sampled calls in the pstats format (eg: for snakeviz)
+        """
+
+        with self.lock:
+            if self.stats is not None:
+                self.stats.dump_stats(filename)
+
+
+def start_exporters(metrics, port=None, filename=None, interval=10):
+    """
+    Start the exporters requested on the command line of a client
+
+    @param metrics: <Metrics>
+    @param port: <int> Port of the HTTPExporter (None to disable it)
+    @param filename: <str> File of the SnapshotExporter (None to disable it)
+    @param interval: <int> Seconds between snapshots
+
+    @return: [<HTTPExporter|SnapshotExporter>] Started exporters
+    """
+
+    exporters = []
+
+    if port:
+        exporters.append(HTTPExporter(metrics, port=port))
+    if filename:
+        exporters.append(SnapshotExporter(metrics, filename=filename, interval=interval))
+
+    [exporter.start() for exporter in exporters]
+    return exporters
@@ -1,8 +1,9 @@
 import threading
 import json
+import logging
 import netifaces as ni
-from time import time, sleep
-from random import randint
+from time import time, sleep, perf_counter
+from random import randint, getrandbits
 from urllib.parse import urlparse
 
 try:
@@ -14,23 +15,86 @@ from mesh.links import UDPLink
 from mesh.filters import DuplicateFilter
 from mesh.node import Node as NetworkComponent
 
+from .admission import AdmissionControl, RATE_LIMITED, MALFORMED, UNSOLICITED, INVALID
+from .bloom import BloomFilter
 from .blockchain import Blockchain
+from .cache import BlockCache
+from .metrics import Metrics
+from .peers import AddressBook, PeerSet
+from .pool import MiningPool
+from .sync import BlockDownloader
+from .wallet import Wallet
+
+
+logger = logging.getLogger(__name__)
 
 
 class Node(threading.Thread):
-    def __init__(self, name, port=5000, blockchain=Blockchain()):
+    # Kind of node advertised to peers ('full' or 'spv')
+    service = None
+
+    # Signed-off block hashes, {<block index>: <hash of the block's header>}
+    checkpoints = {}
+
+    # Headers requested, (<peer>, <time sent>), asked again to another peer after headers_timeout seconds
+    headers_request = None
+    headers_timeout = 2
+
+    # Handshakes of new peers are ignored once we have that many
+    max_peers = 125
+
+    # Every message type a node handles, the others are dropped (and counted in metrics as 'other')
+    message_types = frozenset((
+        'version', 'verack', 'heartbeat', 'heartbeatack',
+        'getdata', 'chain', 'getheaders', 'headers', 'getblocks', 'blocks', 'notfound',
+        'addblock', 'addtx', 'filterload', 'filteradd', 'filterclear', 'merkleblock',
+        'getwork', 'work', 'submit'
+    ))
+
+    # Responses only accepted from peers we sent the request to, {<request type>: <response type>}
+    responses = {
+        'getheaders': 'headers',
+        'getdata': 'chain'
+    }
+
+    def __init__(self, name, port=5000, blockchain=None, interface='en0', links=None, address=None, metrics=None, profiler=None,
+                 wallet=None, address_book=None, network_class=NetworkComponent):
+        """
+        @param name: <str> Name of the node
+        @param port: <int> UDP port the default link listens on
+        @param blockchain: <Blockchain> Initial blockchain (default: a new one with only the genesis block)
+        @param interface: <str> Network interface used for the default link and the node's address
+        @param links: [<VirtualLink>] Links to use instead of a UDPLink on the interface (eg: simulated links)
+        @param address: <str> Address used in the node's identifier (default: the interface's IPv4 address)
+        @param metrics: <Metrics> Where the node records its metrics (default: a new one)
+        @param profiler: <SamplingProfiler> Opt-in profiler of handle_data and proof_of_work
+        @param wallet: <Wallet> Key pair signing the node's transactions (default: a new one)
+        @param address_book: <AddressBook> Peers known from previous runs (default: an empty one)
+        @param network_class: <class> mesh Node reading the links (eg: simulator.SimulatedComponent)
+        """
         threading.Thread.__init__(self)
 
         self.name = name
-        self.address = ni.ifaddresses('en0')[ni.AF_INET][0]['addr']
+        self.address = address or ni.ifaddresses(interface)[ni.AF_INET][0]['addr']
+
+        self.blockchain = blockchain or Blockchain()
+        self.cache = BlockCache(self.blockchain)
+        self.wallet = wallet or Wallet()
 
-        self.blockchain = blockchain
+        self.metrics = metrics or Metrics()
+        self.profiler = profiler
 
         self.peer_info = {}
-        self.peers = set()
+        self.peers = PeerSet()
+
+        self.address_book = address_book or AddressBook()
+        self.version_sent = {}  # target ('' for everyone): time our version was sent, to measure latencies
 
-        self.links = [UDPLink('en0', port=port)]
-        self.network = NetworkComponent(self.links, name, Filters=(DuplicateFilter,))
+        self.admission = AdmissionControl()
+        self.awaiting = set()  # (peer, response type) of the requests sent
+
+        self.links = links or [UDPLink(interface, port=port)]
+        self.network = network_class(self.links, name, Filters=(DuplicateFilter,))
 
         self.keep_listening = True
         self.ready = False
@@ -49,6 +113,38 @@ class Node(threading.Thread):
         parsed_url = urlparse(self.address)
         return f'{parsed_url.path}:{self.name}'
 
+    def assume_valid(self, headers):
+        """
+        Index of the highest checkpoint the headers reach and match, Proof of Work up to it isn't verified
+
+        Headers that don't reach any checkpoint have every Proof of Work verified
+
+        @param headers: [<dict>] Block headers (or blocks) from the genesis block on
+
+        @return: <int>
+        """
+
+        for index in sorted(self.checkpoints, reverse=True):
+            if index <= len(headers):
+                header = headers[index - 1]
+                if Blockchain.hash(header.get('header', header)) == self.checkpoints[index]:
+                    return index
+
+        return 0
+
+    def checkpointed(self, header):
+        """
+        @param header: <dict> Block header out of its chain (eg: the last one of a message)
+
+        @return: <int> Index of the header if it's a checkpoint (its Proof of Work is assumed valid), or 0
+        """
+
+        index = header.get('index') if isinstance(header, dict) else None
+        if isinstance(index, int) and index in self.checkpoints and Blockchain.hash(header) == self.checkpoints[index]:
+            return index
+
+        return 0
+
     # Threading
     def run(self):
         while self.keep_listening:
@@ -59,16 +155,23 @@ class Node(threading.Thread):
                     disconnected_peers.append(peer_id)
 
             for peer_id in disconnected_peers:
-                print(f'Disconnecting {peer_id} for being idle for 30 minutes')
-                self.peer_info.pop(peer_id)
-                self.peers.remove(peer_id)
+                logger.info(f'Disconnecting {peer_id} for being idle for 30 minutes')
+                self.disconnect(peer_id)
+
+            self.tick()
 
-            # Check for new packets
+            # Check for new packets, waking up as soon as one arrives
             for interface in self.network.interfaces:
                 try:
-                    self.recv(self.network.inq[interface].get(timeout=0), interface)
+                    self.recv(self.network.inq[interface].get(timeout=0.1), interface)
                 except Empty:
-                    sleep(0.1)
+                    pass
+
+    def tick(self):
+        """
+        Periodic work done by the node's thread between packets
+        """
+        self.check_headers_request()
 
     def stop(self):
         self.keep_listening = False
@@ -79,6 +182,11 @@ class Node(threading.Thread):
         self.heartbeat_thread.join()
         self.join()
 
+        self.blockchain.verifier.close()
+        if self.blockchain.journal:
+            self.blockchain.journal.close()
+        self.address_book.save()
+
     # I/O
     def send(self, type, message='', target='', encoding='UTF-8'):
         data = json.dumps({
@@ -88,52 +196,229 @@ class Node(threading.Thread):
             'target': target
         })
 
-        print('\nsending {}'.format(data))
+        logger.debug('sending %s', data)
+
+        packet = bytes(data, encoding)
+        self.network.send(packet)
+
+        self.metrics.inc('messages_sent', type=type)
+        self.metrics.inc('bytes_sent', len(packet), type=type)
 
-        self.network.send(bytes(data, encoding))
+        if target and type in self.responses:
+            self.awaiting.add((target, self.responses[type]))
 
         # Update Peer Info
         if target:
-            self.peer_info[target]['lastsend'] = time()
+            if target in self.peer_info:
+                self.peer_info[target]['lastsend'] = time()
         else:
             for peer in self.peers:
                 self.peer_info[peer]['lastsend'] = time()
 
     def recv(self, packet, interface):
-        data = json.loads(packet.decode())
+        try:
+            data = json.loads(packet.decode())
+            valid = all(isinstance(data.get(key), str) for key in ('type', 'identifier', 'message', 'target'))
+        except (ValueError, AttributeError):
+            valid = False
+
+        if not valid:
+            # Can't tell who sent it
+            self.metrics.inc('messages_dropped', reason='malformed')
+            return
 
         # Filter Packets not targeted to you
         if len(data['target']) != 0 and data['target'] != self.identifier:
             return
 
-        print('\nreceived {}'.format(data))
+        logger.debug('received %s', data)
+
+        msg_type = data['type']
+        sender = data['identifier']
+
+        # Types are made up by the sender, don't create a series for each of them
+        label = msg_type if msg_type in self.message_types else 'other'
+        self.metrics.inc('messages_received', type=label)
+        self.metrics.inc('bytes_received', len(packet), type=label)
+
+        reason = self.admit(data)
+        if reason:
+            self.metrics.inc('messages_dropped', reason=reason, type=label)
+            return
+
+        with self.metrics.timer('handle_seconds', type=label):
+            try:
+                if self.profiler:
+                    self.profiler.profile(self.handle_data, data)
+                else:
+                    self.handle_data(data)
+            except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+                logger.warning(f'{sender} sent a malformed {msg_type}: {e!r}')
+                self.misbehaving(sender, MALFORMED, f'malformed {msg_type}')
 
-        self.handle_data(data)
+        self.metrics.set('mempool_size', len(self.blockchain.transaction_pool))
+        self.metrics.set('height', len(self.blockchain.chain))
 
         # Update Peer Info
-        sender = data['identifier']
         if sender in self.peers:
             self.peer_info[sender]['lastrecv'] = time()
+            self.address_book.update(sender)
+
+    def admit(self, data):
+        """
+        Cheap checks deciding whether a packet is worth handling, done before any work proportional to its size
+
+        - Banned peers are ignored, message types no node handles are rejected and every peer is rate limited per message type
+        - Handshakes of unknown peers are rate limited all together
+        - The message is decoded (in place) and its structure checked (see precheck)
+        - Responses are only accepted from peers we sent the request to
+
+        @param data: <dict> Packet
+        @return: <str> Reason to drop the packet, or None if it can be handled
+        """
+
+        msg_type = data['type']
+        sender = data['identifier']
+
+        if self.admission.banned(sender):
+            return 'banned'
+
+        # Before any bucket is created for it, made up types would each get one
+        if msg_type not in self.message_types:
+            self.misbehaving(sender, MALFORMED, 'unknown message type')
+            return 'malformed'
+
+        # Not scored, the identifier of a new peer is no better than the ones it shares the bucket with
+        if msg_type == 'version' and sender not in self.peers and not self.admission.allow_handshake():
+            return 'rate_limited'
+
+        if not self.admission.allow(sender, msg_type):
+            self.misbehaving(sender, RATE_LIMITED, f'too many {msg_type}')
+            return 'rate_limited'
+
+        try:
+            message = json.loads(data['message']) if data['message'] else {}
+        except ValueError:
+            message = None
+
+        if not isinstance(message, dict):
+            self.misbehaving(sender, MALFORMED, f'malformed {msg_type}')
+            return 'malformed'
+
+        data['size'] = len(data['message'])
+        data['message'] = message
+
+        if msg_type in self.responses.values():
+            if (sender, msg_type) not in self.awaiting:
+                self.misbehaving(sender, UNSOLICITED, f'unsolicited {msg_type}')
+                return 'unsolicited'
+            self.awaiting.discard((sender, msg_type))
+
+        if not self.precheck(msg_type, message):
+            self.misbehaving(sender, INVALID, f'invalid {msg_type}')
+            return 'invalid'
+
+        return None
+
+    def precheck(self, msg_type, message):
+        """
+        Check the structure of a message and the Proof of Work of the header it ends with,
+        without looking at the rest of it
+
+        @param msg_type: <str>
+        @param message: <dict> Decoded message
+
+        @return: <bool> False if an honest node wouldn't have sent the message
+        """
+
+        if msg_type == 'version':
+            return isinstance(message.get('height'), int) and isinstance(message.get('pruned', 0), int)
+
+        elif msg_type == 'headers':
+            headers = message.get('headers')
+            return isinstance(headers, list) and len(headers) > 0 and \
+                Blockchain.valid_header_proof(headers[-1], self.checkpointed(headers[-1]))
+
+        elif msg_type == 'addblock':
+            # Whether it's on top of our tip is checked before any validation, but honest peers send blocks that aren't
+            block = message.get('block')
+            header = block.get('header') if isinstance(block, dict) else None
+            return isinstance(message.get('height'), int) and Blockchain.valid_header_proof(header, self.checkpointed(header)) and \
+                isinstance(header.get('previous_hash'), str) and header['index'] <= message['height']
+
+        elif msg_type == 'merkleblock':
+            return isinstance(message.get('txs'), dict) and isinstance(message.get('proofs'), dict) and \
+                Blockchain.valid_header_proof(message.get('header'), self.checkpointed(message.get('header')))
+
+        return True
+
+    def misbehaving(self, peer, score, reason):
+        """
+        Add to the misbehavior score of a peer, disconnecting it once banned
+
+        @param peer: <str> Identifier of the peer
+        @param score: <int> Severity (see admission)
+        @param reason: <str>
+        """
+
+        self.metrics.inc('misbehavior', score)
+        if self.admission.misbehaving(peer, score, reason):
+            self.metrics.inc('peers_banned')
+            self.disconnect(peer, forget=True)
+
+    def disconnect(self, peer, forget=False):
+        """
+        @param peer: <str> Identifier of the peer
+        @param forget: <bool> Also remove the peer from the address book (eg: it is banned)
+        """
+
+        if forget:
+            self.address_book.remove(peer)
+
+        self.peers.discard(peer)
+        self.peer_info.pop(peer, None)
+        self.awaiting = {(p, response) for p, response in self.awaiting if p != peer}
+
+        self.metrics.set('peers', len(self.peers))
 
     def handle_data(self, data):
         # Handle Request
         msg_type = data['type']
         sender = data['identifier']
-        message = json.loads(data['message']) if data['message'] else {}
+        message = data['message']
 
         if msg_type == 'version':
-            registered = self.register_peer(sender, height=message.get('height'))
+            registered = self.register_peer(
+                sender,
+                height=message.get('height'),
+                pruned=message.get('pruned', 0),
+                service=message.get('service')
+            )
+
+            # We have enough peers already
+            if sender not in self.peers:
+                return
+
+            # Answer handshakes, even of known peers (they might have restarted), but not answers to ours
+            if not message.get('ack'):
+                self.send('verack', target=sender)
+                self.send_version(target=sender, ack=True)
 
             if registered:
-                self.send('verack', target=sender)
-                self.send('version', target=sender, message=json.dumps({
-                    'height': len(self.blockchain.chain)
-                }))
-            print(self.peers)
+                logger.info(f'Peers: {self.peers}')
 
         elif msg_type == 'verack':
             self.ready = True
 
+            sent = self.version_sent.pop(sender, None) or self.version_sent.get('')
+            if sent is not None:
+                self.address_book.update(sender)
+                self.address_book.observe_latency(sender, perf_counter() - sent)
+
+        elif msg_type == 'headers':
+            if self.headers_request and self.headers_request[0] == sender:
+                self.headers_request = None
+
         if self.ready:
             if msg_type == 'heartbeat':
                 self.send('heartbeatack', target=sender)
@@ -141,32 +426,150 @@ class Node(threading.Thread):
             elif msg_type == 'heartbeatack':
                 pass
 
+    def send_version(self, target='', ack=False):
+        """
+        @param target: <str> Identifier of the peer to handshake with (default: everyone)
+        @param ack: <bool> True when answering the version of a peer
+        """
+
+        if not ack:
+            self.version_sent[target] = perf_counter()
+
+        self.send('version', target=target, message=json.dumps({
+            'height': len(self.blockchain.chain),
+            'pruned': self.blockchain.pruned_height,
+            'service': self.service,
+            'ack': ack,
+            # Retries are different packets, so they aren't dropped as duplicates
+            'timestamp': time()
+        }))
+
+    def connect(self, count=8, timeout=1):
+        """
+        Handshake with everyone listening and, in parallel, directly with the best peers of the address book
+
+        @param count: <int> Number of known peers to handshake with directly
+        @param timeout: <float> Seconds to wait for the known peers to answer
+
+        @return: <bool> True once connected to the network
+        """
+
+        known = [peer for peer in self.address_book.best(count + 1) if peer != self.identifier][:count]
+
+        # Retries only go to whoever hasn't answered yet, not to rate limit ourselves out of the network
+        if not self.ready:
+            self.send_version()
+        for peer in known:
+            if peer not in self.peers:
+                self.send_version(target=peer)
+
+        deadline = time() + timeout
+        while time() < deadline:
+            if self.ready and all(peer in self.peers for peer in known):
+                break
+            sleep(0.01)
+
+        return self.ready
+
+    def resolve_conflicts(self):
+        """
+        Sync with the network, nodes without a blockchain to keep up to date are always synced
+        """
+        self.synced = True
+
+    def request_headers(self, avoid=None):
+        """
+        Ask the tallest peer taller than us for its headers
+
+        @param avoid: <str> Peer to only ask if no other peer is as tall (eg: it didn't answer)
+
+        @return: <bool> False if no peer is taller than us
+        """
+
+        tall = [
+            (self.peer_info[peer].get('height') or 0, peer != avoid, peer)
+            for peer in self.peers if peer in self.peer_info
+        ]
+        tall = [item for item in tall if item[0] > len(self.blockchain.chain)]
+        if not tall:
+            self.headers_request = None
+            return False
+
+        _, _, peer = max(tall)
+
+        # Retries are different packets, so they aren't dropped as duplicates
+        self.send('getheaders', target=peer, message=json.dumps({'timestamp': time()}))
+        self.headers_request = (peer, time())
+        return True
+
+    def check_headers_request(self):
+        """
+        Ask another peer for headers if the last request timed out
+        """
+
+        if self.headers_request:
+            peer, sent = self.headers_request
+            if time() - sent > self.headers_timeout:
+                logger.info(f'{peer} didn\'t send its headers, asking another peer')
+                self.metrics.inc('sync_stalls')
+                self.request_headers(avoid=peer)
+
+    def sync(self, timeout=5):
+        """
+        Ask peers for what we are missing and wait until synced
+
+        @param timeout: <float> Seconds to wait before giving up
+
+        @return: <bool> True if synced
+        """
+
+        self.resolve_conflicts()
+
+        deadline = time() + timeout
+        while not self.synced and time() < deadline:
+            sleep(0.01)
+
+        return self.synced
+
     def send_heartbeat(self):
         while self.keep_listening and self.ready:
             sleep(60*30)
             self.send('heartbeat')
 
     # Methods
-    def register_peer(self, identifier, height):
+    def register_peer(self, identifier, height, pruned=0, service=None):
         """
         Add a new node to the list of nodes
 
         @param identifier: <str> Identifier of the node (eg: 'address:name')
+        @param height: <int> Height of the node's blockchain
+        @param pruned: <int> Index up to which the node only has block headers
+        @param service: <str> Kind of node ('full' or 'spv')
 
-        @return: <bool> True if a new peer was registered, False otherwise
+        @return: <bool> True if a new peer was registered, False otherwise (including when there are max_peers already)
         """
 
+        if identifier not in self.peers and len(self.peers) >= self.max_peers:
+            logger.debug(f'Ignoring {identifier}, there are {len(self.peers)} peers already')
+            return False
+
+        self.address_book.update(identifier, height=height, pruned=pruned, service=service)
+
         if identifier not in self.peers:
             self.peers.add(identifier)
             self.peer_info[identifier] = {
                 'identifier': identifier,
                 'lastrecv': time(),
                 'lastsend': 0,
-                'height': height
+                'height': height,
+                'pruned': pruned,
+                'service': service
             }
+            self.metrics.set('peers', len(self.peers))
 
             return True
         else:
+            self.peer_info[identifier].update(height=height, pruned=pruned, service=service)
             return False
 
     def get_peer(self, index=None):
@@ -175,17 +578,16 @@ class Node(threading.Thread):
 
         @param index: <int> Index of the peer in the peer list
 
-        @return: <str> Peer identifier
+        @return: <str> Peer identifier (None if there are no peers)
         """
 
+        if not self.peers:
+            return None
+
         if index is None:
             index = randint(0, len(self.peers) - 1)
 
-        i = 0
-        for p in self.peers:
-            if i == index:
-                return p
-            i += 1
+        return self.peers[index]
 
 
 class BlockchainNode(Node):
@@ -200,32 +602,203 @@ class BlockchainNode(Node):
     3. Listen for new blocks and transactions
     """
 
+    service = 'full'
+
+    # Headers-first sync (see BlockDownloader)
+    downloader = None
+    sync_window = 16
+    sync_max_inflight = 2
+    sync_timeout = 2
+
+    # Services of the peers blocks are downloaded from, the others don't answer getblocks
+    sync_services = ('full', 'pool')
+
+    # Keep the bodies of only this many recent blocks (None keeps everything)
+    prune_depth = None
+
+    # Most blocks a peer can ask for in one getblocks
+    max_blocks_per_request = 64
+
     def resolve_conflicts(self):
         """
         The Consensus Algorithm, replaces our chain with the longest valid chain in the network
 
+        1. Ask the tallest peer for its headers and verify them
+        2. Download the missing blocks from every peer tall enough to have them (see sync_blocks)
+
         Note: This is not the algorithm the actual Bitcoin Core uses as it requires much more P2P,
         as a proof of concept, this was more suitable
         """
-        print('Resolving Conflicts!')
+        logger.info('Resolving Conflicts!')
 
-        max_height = len(self.blockchain.chain)
-        max_height_peer = None
+        # Check if we actually need to update our blockchain
+        if not self.request_headers():
+            # Didn't need to update our blockchain
+            self.synced = True
 
-        for peer in self.peers:
-            peer_info = self.peer_info.get(peer)
-            if peer_info:
-                height = peer_info.get('height')
-                if height > max_height:
-                    max_height = height
-                    max_height_peer = peer
+    def sync_headers(self, headers):
+        """
+        Start downloading the blocks of a verified header chain that is longer than ours
 
-        # Check if we actually need to update our blockchain
-        if max_height_peer:
-            self.send('getdata', target=max_height_peer)
+        @param headers: [<dict>] Verified block headers
+        """
+
+        chain = self.blockchain.chain
+        if len(headers) <= len(chain):
+            self.synced = True
+            return
+
+        # Already downloading this chain (or a longer one)
+        if self.downloader and self.downloader.height >= len(headers):
+            return
+
+        # Find the first block where our chain and the headers diverge
+        fork = 0
+        while fork < len(chain) and Blockchain.hash(chain[fork]['header']) == Blockchain.hash(headers[fork]):
+            fork += 1
+
+        if self.downloader:
+            # Blocks already downloaded are kept, a block mined while syncing doesn't start it over
+            self.downloader.extend(headers, start=fork + 1)
         else:
-            # Didn't need to update our blockchain
+            self.downloader = BlockDownloader(
+                headers,
+                start=fork + 1,
+                window=self.sync_window,
+                max_inflight=self.sync_max_inflight,
+                timeout=self.sync_timeout
+            )
+        self.sync_blocks()
+
+    def sync_blocks(self):
+        """
+        Request the pending windows of blocks from peers and apply the downloaded chain once complete
+        """
+
+        downloader = self.downloader
+        if not downloader:
+            return
+
+        if downloader.complete:
+            blocks = downloader.chain()
+            chain = self.blockchain.chain[:downloader.start - 1] + blocks
+            self.blockchain.chain = chain
+            self.cache.reorg(downloader.start)
+            self.blockchain.tx_info = {**self.blockchain.tx_info, **downloader.tx_info}
+            self.blockchain.remove_confirmed(blocks)
+            self.blockchain.pruned_height = min(self.blockchain.pruned_height, downloader.start - 1)
+            self.downloader = None
             self.synced = True
+            self.prune()
+            logger.info(f'Synced to height {len(chain)}')
+            return
+
+        peers = [peer for peer in self.peers if self.peer_info.get(peer, {}).get('service') in self.sync_services]
+        peer_heights = {peer: self.peer_info[peer].get('height') for peer in peers}
+        peer_pruned = {peer: self.peer_info[peer].get('pruned') for peer in peers}
+        for peer, request_id, indices in downloader.assign(peer_heights, peer_pruned):
+            self.send('getblocks', target=peer, message=json.dumps({
+                'request': request_id,
+                'indices': indices
+            }))
+
+    def prune(self):
+        """
+        Prune the blockchain down to prune_depth whole blocks (if pruning is enabled)
+        """
+
+        if self.prune_depth:
+            pruned = self.blockchain.prune(self.prune_depth)
+            if pruned:
+                self.metrics.inc('blocks_pruned', pruned)
+                self.metrics.set('tx_info_size', len(self.blockchain.tx_info))
+
+    def record_cache_metrics(self):
+        for name, stats in self.cache.stats().items():
+            self.metrics.set('cache_hit_rate', stats['hit_rate'], cache=name)
+            self.metrics.set('cache_size', stats['size'], cache=name)
+
+    def relay_filtered(self, block):
+        """
+        Send the transactions of a new block that match the bloom filters of SPV peers, with their merkle paths
+
+        @param block: <dict> Block that was just added to the blockchain
+        """
+
+        for peer in list(self.peers):
+            bloom_filter = self.peer_info.get(peer, {}).get('filter')
+            if not bloom_filter:
+                continue
+
+            txs = {}
+            for tx_hash in block['transactions']:
+                tx = self.blockchain.tx_info.get(tx_hash)
+                if tx and bloom_filter.matches(tx_hash, tx):
+                    txs[tx_hash] = tx
+
+                    # Match the transactions spending this one too
+                    bloom_filter.add(tx_hash)
+
+            if txs:
+                self.send('merkleblock', target=peer, message=json.dumps({
+                    'header': block['header'],
+                    'txs': txs,
+                    'proofs': {tx_hash: Blockchain.merkle_path(block['merkle_tree'], tx_hash) for tx_hash in txs}
+                }))
+                self.metrics.inc('filtered_txs_sent', len(txs))
+
+    def validate_history(self):
+        """
+        Verify the Proof of Work of the blocks that were assumed valid (eg: loaded from a snapshot)
+
+        Meant to run in the background, it doesn't block the node from syncing
+
+        @return: <bool> True if the history is valid
+        """
+
+        headers = [block['header'] for block in self.blockchain.chain[:self.assume_valid(self.blockchain.chain)]]
+        valid = Blockchain.valid_headers(headers)
+
+        self.metrics.set('history_valid', int(valid))
+        if valid:
+            logger.info(f'Validated the history up to block {len(headers)}')
+        else:
+            logger.error(f'History up to block {len(headers)} is NOT valid, the checkpoints can\'t be trusted')
+
+        return valid
+
+    # @override
+    def precheck(self, msg_type, message):
+        if not Node.precheck(self, msg_type, message):
+            return False
+
+        if msg_type == 'chain':
+            chain = message.get('chain')
+            return isinstance(chain, list) and len(chain) > 0 and isinstance(chain[-1], dict) and \
+                isinstance(message.get('tx_info'), dict) and \
+                Blockchain.valid_header_proof(chain[-1].get('header'), self.checkpointed(chain[-1].get('header')))
+
+        elif msg_type == 'addblock':
+            return isinstance(message.get('tx_info'), dict) and isinstance(message['block'].get('transactions'), list)
+
+        elif msg_type == 'getblocks':
+            indices = message.get('indices')
+            return isinstance(indices, list) and len(indices) <= self.max_blocks_per_request
+
+        elif msg_type == 'blocks':
+            return isinstance(message.get('blocks'), list) and isinstance(message.get('tx_info'), dict)
+
+        return True
+
+    # @override
+    def tick(self):
+        Node.tick(self)
+
+        if self.downloader:
+            for peer in self.downloader.check_stalls():
+                logger.info(f'{peer} stalled, reassigning its blocks')
+                self.metrics.inc('sync_stalls')
+            self.sync_blocks()
 
     # @override
     def handle_data(self, data):
@@ -234,18 +807,84 @@ class BlockchainNode(Node):
         # Handle Request
         msg_type = data['type']
         sender = data['identifier']
-        message = json.loads(data['message']) if data['message'] else {}
+        message = data['message']
 
         if msg_type == 'getdata':
-            self.send('chain', target=sender, message=json.dumps({
-                'chain': self.blockchain.chain,
-                'tx_info': self.blockchain.tx_info
-            }))
+            if self.blockchain.pruned_height:
+                # We don't have the whole blockchain anymore
+                self.send('notfound', target=sender, message=json.dumps({
+                    'type': 'getdata',
+                    'pruned': self.blockchain.pruned_height
+                }))
+            else:
+                self.send('chain', target=sender, message=self.cache.chain_message())
+                self.record_cache_metrics()
+
+        elif msg_type == 'filterload':
+            if sender in self.peer_info:
+                try:
+                    self.peer_info[sender]['filter'] = BloomFilter.from_dict(message['filter'])
+                except (KeyError, TypeError, ValueError):
+                    logger.warning(f'{sender} sent an invalid bloom filter')
+
+        elif msg_type == 'filteradd':
+            bloom_filter = self.peer_info.get(sender, {}).get('filter')
+            if bloom_filter:
+                bloom_filter.add(message['item'])
+
+        elif msg_type == 'filterclear':
+            if sender in self.peer_info:
+                self.peer_info[sender].pop('filter', None)
+
+        elif msg_type == 'notfound':
+            logger.info(f'{sender} cannot answer {message.get("type")}, it pruned blocks up to {message.get("pruned")}')
+
+            if sender in self.peers:
+                self.peer_info[sender]['pruned'] = message.get('pruned', 0)
 
         elif msg_type == 'getheaders':
-            self.send('headers', target=sender, message=json.dumps({
-                'headers': list(map(lambda block: block['header'], self.blockchain.chain))
-            }))
+            self.send('headers', target=sender, message=self.cache.headers_message())
+            self.record_cache_metrics()
+
+        elif msg_type == 'getblocks':
+            indices = [index for index in message['indices'] if self.blockchain.pruned_height < index <= len(self.blockchain.chain)]
+
+            self.send('blocks', target=sender, message=self.cache.blocks_message(message['request'], indices))
+            self.record_cache_metrics()
+
+        elif msg_type == 'headers':
+            headers = message['headers']
+
+            # Update Peer Info
+            if sender in self.peers:
+                self.peer_info[sender]['height'] = len(headers)
+
+            with self.metrics.timer('validation_seconds', kind='headers'):
+                valid = Blockchain.matches_checkpoints(headers, self.checkpoints) and \
+                    Blockchain.valid_headers(headers, self.assume_valid(headers))
+
+            if valid:
+                self.sync_headers(headers)
+            else:
+                self.misbehaving(sender, INVALID, 'invalid headers')
+                self.resolve_conflicts()
+
+        elif msg_type == 'blocks':
+            if self.downloader:
+                with self.metrics.timer('validation_seconds', kind='blocks'):
+                    valid = self.blockchain.verify_signatures(message['tx_info'], message['blocks']) and self.downloader.receive(
+                        sender,
+                        message['request'],
+                        message['blocks'],
+                        message['tx_info'],
+                        size=data['size']
+                    )
+
+                if not valid:
+                    logger.warning(f'{sender} sent blocks that don\'t match the headers')
+
+                self.metrics.inc('blocks_downloaded', len(message['blocks']))
+                self.sync_blocks()
 
         elif msg_type == 'chain':
             chain = message['chain']
@@ -255,13 +894,28 @@ class BlockchainNode(Node):
             if sender in self.peers:
                 self.peer_info[sender]['height'] = len(chain)
 
+            # Not worth validating
+            if len(chain) <= len(self.blockchain.chain):
+                return
+
             # Update Chain
-            if Blockchain.valid_chain(chain):
+            with self.metrics.timer('validation_seconds', kind='chain'):
+                headers = [block['header'] for block in chain]
+                valid = Blockchain.matches_checkpoints(headers, self.checkpoints) and \
+                    Blockchain.valid_chain(chain, self.assume_valid(chain)) and \
+                    self.blockchain.verify_signatures(tx_info, chain)
+
+            if valid:
                 self.blockchain.chain = chain
                 self.blockchain.tx_info = {**self.blockchain.tx_info, **tx_info}
+                self.cache.reorg(1)
+                self.blockchain.remove_confirmed(chain)
+                self.blockchain.pruned_height = 0
                 self.synced = True
+                self.prune()
             else:
                 # Invaild chain, ask for another peer's
+                self.misbehaving(sender, INVALID, 'invalid chain')
                 self.resolve_conflicts()
 
         elif msg_type == 'addblock':
@@ -273,16 +927,26 @@ class BlockchainNode(Node):
             if sender in self.peers:
                 self.peer_info[sender]['height'] = height
 
-            # Update Chain
-            chain = self.blockchain.chain.copy()
-            chain.append(new_block)
+            # Only a block on top of our tip is validated, the peer is ahead of us or on another fork otherwise
+            tip = self.blockchain.last_block['header']
+            header = new_block['header']
+            if header['index'] != tip['index'] + 1 or header['previous_hash'] != Blockchain.hash(tip):
+                if height > len(self.blockchain.chain):
+                    self.resolve_conflicts()
+                return
 
-            if Blockchain.valid_chain(chain):
-                self.blockchain.chain = chain
+            with self.metrics.timer('validation_seconds', kind='block'):
+                valid = Blockchain.valid_next_header(tip, header) and Blockchain.valid_block(new_block, header, tx_info) and \
+                    self.blockchain.verify_signatures(tx_info, [new_block])
+
+            if valid:
+                self.blockchain.chain = self.blockchain.chain + [new_block]
                 self.blockchain.tx_info = {**self.blockchain.tx_info, **tx_info}
+                self.blockchain.remove_confirmed([new_block])
+                self.relay_filtered(new_block)
+                self.prune()
             else:
-                # Invalid chain, ask for another peer's chain
-                self.resolve_conflicts()
+                self.misbehaving(sender, INVALID, 'invalid block')
 
 
 class MinerNode(BlockchainNode):
@@ -302,10 +966,24 @@ class MinerNode(BlockchainNode):
         @return: <int> proof of work for the new block
         """
 
+        if self.profiler:
+            return self.profiler.profile(self._proof_of_work, prev_hash)
+
+        return self._proof_of_work(prev_hash)
+
+    def _proof_of_work(self, prev_hash):
+        start = perf_counter()
+
         proof = 0
         while Blockchain.valid_proof(prev_hash, proof) is False:
             proof += 1
 
+        elapsed = perf_counter() - start
+        self.metrics.inc('hashes', proof + 1)
+        self.metrics.observe('proof_of_work_seconds', elapsed)
+        if elapsed > 0:
+            self.metrics.set('hash_rate', (proof + 1) / elapsed)
+
         return proof
 
     def mine(self):
@@ -317,21 +995,28 @@ class MinerNode(BlockchainNode):
         prev_hash = Blockchain.hash(last_block['header'])
         proof = self.proof_of_work(prev_hash)
 
+        self.add_mined_block(proof, prev_hash)
+
+    def add_mined_block(self, proof, prev_hash):
+        """
+        Create the block of a found proof, reward ourselves and announce it
+
+        @param proof: <int> proof of work for the new block
+        @param prev_hash: <str> Last Block's hash
+        """
+
         # Create a special transaction which acts as the reward for the miner
-        # TODO: Change amount so it decreases over time
-        self.blockchain.verify_and_add_transaction(
-            previous_hash='0',
-            sender='0',
-            recipient=self.identifier,
-            amount=50
-        )
+        self.blockchain.add_reward(self.wallet.address)
 
         block = self.blockchain.add_block(proof, prev_hash)
-        self.send('addblock', message=json.dumps({
-            'block': block,
-            'tx_info': self.blockchain.tx_info,
-            'height': len(self.blockchain.chain)
-        }))
+        self.relay_filtered(block)
+        self.prune()
+        self.metrics.inc('blocks_mined')
+        self.metrics.set('mempool_size', len(self.blockchain.transaction_pool))
+        self.metrics.set('height', len(self.blockchain.chain))
+
+        # Only the block's transactions, peers already have the rest (or pruned it)
+        self.send('addblock', message=self.cache.addblock_message(block['header']['index']))
 
     # @override
     def handle_data(self, data):
@@ -339,14 +1024,219 @@ class MinerNode(BlockchainNode):
 
         # Handle Request
         msg_type = data['type']
-        message = json.loads(data['message']) if data['message'] else {}
+        message = data['message']
 
         if msg_type == 'addtx':
             # Add Transaction
             new_tx = json.loads(message['tx'])
-            new_tx.pop('timestamp')
 
-            self.blockchain.verify_and_add_transaction(**new_tx)
+            self.blockchain.verify_and_add_transaction(
+                sender=new_tx.get('sender'),
+                recipient=new_tx.get('recipient'),
+                amount=new_tx.get('amount'),
+                previous_hash=new_tx.get('previous_hash'),
+                timestamp=new_tx.get('timestamp'),
+                signature=new_tx.get('signature')
+            )
+
+
+class PoolCoordinatorNode(MinerNode):
+    """
+    Mining Pool Coordinator
+
+    - Doesn't search proofs itself, hands out disjoint ranges of proofs to worker nodes (see MiningPool)
+    - Accounts the shares of every worker and creates the block of a found proof
+    - Pushes new work to every worker as soon as the tip changes
+    """
+
+    service = 'pool'
+
+    def __init__(self, *args, **kwargs):
+        self.pool = MiningPool()
+
+        MinerNode.__init__(self, *args, **kwargs)
+
+    def update_work(self):
+        """
+        Start a new job if the tip changed and push it to every worker
+        """
+
+        prev_hash = Blockchain.hash(self.blockchain.last_block['header'])
+        if prev_hash == self.pool.prev_hash:
+            return
+
+        job = self.pool.new_work(prev_hash)
+        logger.info(f'New job {job} for block {len(self.blockchain.chain) + 1}')
+
+        for worker in self.pool.workers:
+            if worker in self.peers:
+                self.send_work(worker)
+
+    def send_work(self, worker):
+        self.send('work', target=worker, message=json.dumps(self.pool.assign(worker)))
+
+    # @override
+    def precheck(self, msg_type, message):
+        if not MinerNode.precheck(self, msg_type, message):
+            return False
+
+        if msg_type == 'submit':
+            proofs = message.get('proofs')
+            return isinstance(message.get('job'), int) and isinstance(proofs, list) and \
+                all(isinstance(proof, int) for proof in proofs)
+
+        return True
+
+    # @override
+    def tick(self):
+        MinerNode.tick(self)
+        self.update_work()
+
+    # @override
+    def handle_data(self, data):
+        MinerNode.handle_data(self, data)
+
+        # Handle Request
+        msg_type = data['type']
+        sender = data['identifier']
+        message = data['message']
+
+        # The tip might have just changed
+        self.update_work()
+
+        if msg_type == 'getwork':
+            if sender in self.peers:
+                self.send_work(sender)
+
+        elif msg_type == 'submit':
+            for proof in message['proofs']:
+                result = self.pool.submit(sender, message['job'], proof)
+                self.metrics.inc('pool_proofs', result=result)
+
+                if result == 'invalid':
+                    self.misbehaving(sender, INVALID, 'invalid share')
+                    return
+
+                if result == 'block':
+                    logger.info(f'{sender} found the proof of block {len(self.blockchain.chain) + 1}')
+                    self.add_mined_block(proof, self.pool.prev_hash)
+                    self.update_work()
+                    return
+
+
+class PoolWorkerNode(Node):
+    """
+    Mining Pool Worker
+
+    - Searches the ranges of proofs handed out by a pool coordinator
+    - Submits its shares once a range is searched, and a block's proof as soon as it is found
+    - Drops its range as soon as the coordinator pushes new work
+    """
+
+    service = 'worker'
+
+    # Proofs searched between checks for new work
+    chunk_size = 4096
+
+    def __init__(self, *args, **kwargs):
+        self.coordinator = None
+        self.work = None
+
+        Node.__init__(self, *args, **kwargs)
+
+    def request_work(self):
+        """
+        Ask a pool coordinator peer for work
+
+        @return: <bool> True if there is a coordinator to ask
+        """
+
+        if self.coordinator not in self.peers:
+            coordinators = [peer for peer in self.peers if self.peer_info.get(peer, {}).get('service') == 'pool']
+            self.coordinator = coordinators[0] if coordinators else None
+
+        if self.coordinator is None:
+            return False
+
+        # Asking again is a different packet, so it isn't dropped as a duplicate
+        self.send('getwork', target=self.coordinator, message=json.dumps({'timestamp': time()}))
+        return True
+
+    def mine(self):
+        """
+        Search the current range of proofs, then submit its shares and ask for the next one
+
+        @return: <bool> True if a range was searched (completely or until new work arrived)
+        """
+
+        work = self.work
+        if work is None:
+            return False
+
+        prev_hash = work['prev_hash']
+        share_difficulty = work['share_difficulty']
+        shares = []
+        hashes = 0
+        start = perf_counter()
+
+        for chunk in range(work['start'], work['end'], self.chunk_size):
+            # New work was pushed, this range is stale
+            if self.work is not work:
+                break
+
+            for proof in range(chunk, min(chunk + self.chunk_size, work['end'])):
+                if not Blockchain.valid_proof(prev_hash, proof, share_difficulty):
+                    continue
+
+                if Blockchain.valid_proof(prev_hash, proof):
+                    # Don't wait for the end of the range to submit a block
+                    self.send('submit', target=self.coordinator, message=json.dumps({
+                        'job': work['job'],
+                        'proofs': [proof]
+                    }))
+                else:
+                    shares.append(proof)
+
+            hashes += min(chunk + self.chunk_size, work['end']) - chunk
+
+        elapsed = perf_counter() - start
+        self.metrics.inc('hashes', hashes)
+        if elapsed > 0:
+            self.metrics.set('hash_rate', hashes / elapsed)
+
+        if self.work is work:
+            self.work = None
+            if shares:
+                self.send('submit', target=self.coordinator, message=json.dumps({
+                    'job': work['job'],
+                    'proofs': shares
+                }))
+            self.request_work()
+
+        return True
+
+    # @override
+    def precheck(self, msg_type, message):
+        if not Node.precheck(self, msg_type, message):
+            return False
+
+        if msg_type == 'work':
+            return all(isinstance(message.get(key), int) for key in ('job', 'start', 'end', 'share_difficulty')) and \
+                isinstance(message.get('prev_hash'), str)
+
+        return True
+
+    # @override
+    def handle_data(self, data):
+        Node.handle_data(self, data)
+
+        # Handle Request
+        msg_type = data['type']
+        sender = data['identifier']
+        message = data['message']
+
+        if msg_type == 'work' and sender == self.coordinator:
+            self.work = message
 
 
 class SPVNode(Node):
@@ -356,8 +1246,65 @@ class SPVNode(Node):
     - Download only block headers
     - Unable to verify UTXOs (Unspent Transaction Output)
     - Downloads a block header and the 6 next succeeding block headers related to a transaction
+    - Loads a bloom filter into a full node to only receive the transactions that concern it
     """
 
+    service = 'spv'
+
+    # Number of full nodes the bloom filter is loaded into
+    filter_peers = 1
+
+    def __init__(self, *args, **kwargs):
+        self.bloom_filter = None
+        self.filter_targets = []
+        self.transactions = {}  # tx hash: {tx: <dict>, block: <int>}
+
+        Node.__init__(self, *args, **kwargs)
+
+    def load_filter(self, items, capacity=100, fp_rate=0.0001):
+        """
+        Load a bloom filter of the items we're interested in into full node peers
+
+        @param items: [<str>] Addresses and transaction hashes
+        @param capacity: <int> Number of items the filter is sized for (including ones added later)
+        @param fp_rate: <float> False positive rate of the filter
+        """
+
+        self.bloom_filter = BloomFilter.optimal(max(len(items), capacity), fp_rate, tweak=getrandbits(32))
+        for item in items:
+            self.bloom_filter.add(item)
+
+        full_peers = [peer for peer in self.peers if self.peer_info.get(peer, {}).get('service') == 'full']
+        full_peers.sort(key=lambda peer: self.peer_info[peer].get('height') or 0, reverse=True)
+        self.filter_targets = full_peers[:self.filter_peers]
+
+        for peer in self.filter_targets:
+            self.send('filterload', target=peer, message=json.dumps({
+                'filter': self.bloom_filter.to_dict()
+            }))
+
+    def watch(self, item):
+        """
+        Add an address or a transaction hash to the loaded bloom filter
+
+        @param item: <str>
+        """
+
+        self.bloom_filter.add(item)
+        for peer in self.filter_targets:
+            self.send('filteradd', target=peer, message=json.dumps({
+                'item': item
+            }))
+
+    def confirmations(self, tx_hash):
+        """
+        @return: <int> Number of blocks on top of (and including) the block of a transaction, 0 if unknown
+        """
+
+        if tx_hash not in self.transactions:
+            return 0
+        return len(self.blockchain.chain) - self.transactions[tx_hash]['block'] + 1
+
     def resolve_conflicts(self):
         """
         The Consensus Algorithm, replaces our chain with the longest valid chain in the network
@@ -365,23 +1312,10 @@ class SPVNode(Node):
         Note: This is not the algorithm the actual Bitcoin Core uses as it requires much more P2P,
         as a proof of concept, this was more suitable
         """
-        print('Resolving Conflicts!')
-
-        max_height = len(self.blockchain.chain)
-        max_height_peer = None
-
-        for peer in self.peers:
-            peer_info = self.peer_info.get(peer)
-            if peer_info:
-                height = peer_info.get('height')
-                if height > max_height:
-                    max_height = height
-                    max_height_peer = peer
+        logger.info('Resolving Conflicts!')
 
         # Check if we actually need to update our blockchain
-        if max_height_peer:
-            self.send('getheaders', target=max_height_peer)
-        else:
+        if not self.request_headers():
             # Didn't need to update our blockchain
             self.synced = True
 
@@ -392,7 +1326,7 @@ class SPVNode(Node):
         # Handle Request
         msg_type = data['type']
         sender = data['identifier']
-        message = json.loads(data['message']) if data['message'] else {}
+        message = data['message']
 
         if msg_type == 'getheaders':
             # Send blockchain.chain cause its chain only contains headers
@@ -408,10 +1342,15 @@ class SPVNode(Node):
                 self.peer_info[sender]['height'] = len(headers)
 
             # Update Chain with just headers
-            if Blockchain.valid_headers(headers):
+            with self.metrics.timer('validation_seconds', kind='headers'):
+                valid = Blockchain.matches_checkpoints(headers, self.checkpoints) and \
+                    Blockchain.valid_headers(headers, self.assume_valid(headers))
+
+            if valid:
                 self.blockchain.chain = headers
                 self.synced = True
             else:
+                self.misbehaving(sender, INVALID, 'invalid headers')
                 self.resolve_conflicts()
 
         elif msg_type == 'addblock':
@@ -422,16 +1361,52 @@ class SPVNode(Node):
             if sender in self.peers:
                 self.peer_info[sender]['height'] = height
 
-            # Update Chain
-            chain = self.blockchain.chain.copy()
-            chain.append(new_block_header)
+            # Already added by a merkleblock
+            index = new_block_header['index']
+            chain = self.blockchain.chain
+            if 0 < index <= len(chain) and Blockchain.hash(chain[index - 1]) == Blockchain.hash(new_block_header):
+                return
 
-            if Blockchain.valid_chain(chain):
-                self.blockchain.chain = chain
+            # Only a header on top of our tip is validated, the peer is ahead of us or on another fork otherwise
+            tip = chain[-1]
+            if index != tip['index'] + 1 or new_block_header['previous_hash'] != Blockchain.hash(tip):
+                if height > len(chain):
+                    self.resolve_conflicts()
+                return
+
+            with self.metrics.timer('validation_seconds', kind='header'):
+                valid = Blockchain.valid_next_header(tip, new_block_header)
+
+            if valid:
+                self.blockchain.chain = chain + [new_block_header]
             else:
-                # Invalid chain, ask for another peer's chain
-                self.resolve_conflicts()
+                self.misbehaving(sender, INVALID, 'invalid block')
 
         elif msg_type == 'merkleblock':
-            # Verify the transaction with the merkle path
-            pass
+            header = message['header']
+            index = header['index']
+
+            # The header might come before the block's addblock
+            chain = self.blockchain.chain
+            if index == len(chain) + 1 and Blockchain.valid_next_header(chain[-1], header):
+                self.blockchain.chain = chain = chain + [header]
+
+            if not 0 < index <= len(chain) or Blockchain.hash(chain[index - 1]) != Blockchain.hash(header):
+                logger.warning(f'{sender} sent a merkleblock for an unknown block')
+                return
+
+            # Verify the transactions with their merkle paths
+            for tx_hash, tx in message['txs'].items():
+                path = message['proofs'].get(tx_hash)
+
+                if path is None or Blockchain.tx_hash(tx) != tx_hash or \
+                        not Blockchain.valid_merkle_path(tx_hash, path, header['merkleroot']):
+                    logger.warning(f'{sender} sent an invalid merkle path for {tx_hash}')
+                    continue
+
+                self.transactions[tx_hash] = {'tx': tx, 'block': index}
+                if self.bloom_filter:
+                    # Same update as the full node, to match the transactions spending this one
+                    self.bloom_filter.add(tx_hash)
+
+                logger.info(f'Transaction {tx_hash} is in block {index}')
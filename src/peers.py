@@ -0,0 +1,165 @@
+import os
+import json
+import heapq
+import threading
+from time import time
+
+
+class PeerSet(object):
+    """
+    Set of peer identifiers which can also be indexed, to pick a (random) peer in O(1)
+    """
+
+    def __init__(self, peers=()):
+        self.items = []
+        self.positions = {}  # peer: index in items
+
+        for peer in peers:
+            self.add(peer)
+
+    def add(self, peer):
+        if peer not in self.positions:
+            self.positions[peer] = len(self.items)
+            self.items.append(peer)
+
+    def discard(self, peer):
+        index = self.positions.pop(peer, None)
+        if index is None:
+            return
+
+        # Move the last peer into the hole
+        last = self.items.pop()
+        if index < len(self.items):
+            self.items[index] = last
+            self.positions[last] = index
+
+    def remove(self, peer):
+        if peer not in self.positions:
+            raise KeyError(peer)
+        self.discard(peer)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __contains__(self, peer):
+        return peer in self.positions
+
+    def __iter__(self):
+        # A copy, peers can come and go while another thread iterates
+        return iter(list(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f'{{{", ".join(map(repr, self.items))}}}'
+
+
+class AddressBook(object):
+    """
+    Peers we have been connected to, kept across restarts to reconnect to the best ones right away
+
+    Entries have the following structure:
+    {
+        'last_seen': <time>  # last time we received a packet from the peer
+        'height': <int>  # last known height of the peer's blockchain
+        'pruned': <int>  # index up to which the peer only has block headers
+        'service': <str>  # kind of node
+        'latency': <float>  # smoothed round trip time of a handshake, in seconds
+    }
+    """
+
+    def __init__(self, filename=None, max_age=60*60*24, max_entries=1000):
+        """
+        @param filename: <str> File the address book is loaded from and saved to (default: only kept in memory)
+        @param max_age: <float> Seconds after which a peer isn't worth trying anymore
+        @param max_entries: <int> Number of peers remembered
+        """
+
+        self.filename = filename
+        self.max_age = max_age
+        self.max_entries = max_entries
+
+        self.entries = {}  # identifier: entry
+        self.lock = threading.Lock()
+
+        if filename:
+            try:
+                with open(filename) as infile:
+                    self.entries = json.load(infile)
+            except FileNotFoundError:
+                pass
+
+    def update(self, identifier, **fields):
+        """
+        Update what we know about a peer, marking it as seen now
+
+        @param identifier: <str> Identifier of the peer
+        @param fields: Entry fields to update (height, pruned, service)
+        """
+
+        with self.lock:
+            entry = self.entries.setdefault(identifier, {'latency': None})
+            entry.update(fields, last_seen=time())
+
+            if len(self.entries) > self.max_entries:
+                oldest = min(self.entries, key=lambda peer: self.entries[peer]['last_seen'])
+                self.entries.pop(oldest)
+
+    def observe_latency(self, identifier, latency, weight=0.25):
+        """
+        Fold a round trip time measurement into the peer's latency
+
+        @param identifier: <str> Identifier of the peer
+        @param latency: <float> Round trip time in seconds
+        @param weight: <float> Weight of the new measurement
+        """
+
+        with self.lock:
+            entry = self.entries.get(identifier)
+            if entry is None:
+                return
+
+            previous = entry.get('latency')
+            entry['latency'] = latency if previous is None else (1 - weight) * previous + weight * latency
+
+    def best(self, count, now=None):
+        """
+        @param count: <int> Number of peers
+        @param now: <time>
+
+        @return: [<str>] Identifiers of the peers seen recently with the lowest latency, best first
+        """
+
+        now = time() if now is None else now
+
+        with self.lock:
+            recent = [(peer, entry) for peer, entry in self.entries.items() if now - entry['last_seen'] < self.max_age]
+
+        # Unknown latencies go last, the most recently seen first
+        def rank(item):
+            peer, entry = item
+            latency = entry.get('latency')
+            return (latency is None, latency or 0, -entry['last_seen'])
+
+        return [peer for peer, _ in heapq.nsmallest(count, recent, key=rank)]
+
+    def get(self, identifier):
+        return self.entries.get(identifier)
+
+    def remove(self, identifier):
+        with self.lock:
+            self.entries.pop(identifier, None)
+
+    def save(self):
+        if not self.filename:
+            return
+
+        with self.lock:
+            data = json.dumps(self.entries, indent=4)
+
+        # Write then rename so a crash never leaves a half-written address book
+        tmp = f'{self.filename}.tmp'
+        with open(tmp, 'w') as outfile:
+            outfile.write(data)
+        os.replace(tmp, self.filename)
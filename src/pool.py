@@ -0,0 +1,108 @@
+from .blockchain import Blockchain
+
+
+class MiningPool(object):
+    """
+    Splits the Proof of Work of the next block between several workers
+
+    - The proof only depends on the previous block's hash, so the work of a job is that hash
+    - Each worker is handed a disjoint range of proofs to search, nobody searches the same proof twice
+    - Workers submit shares (proofs meeting an easier difficulty) to show how much they searched
+    - A new job starts as soon as the tip changes, proofs of older jobs are stale
+    """
+
+    def __init__(self, range_size=2**16, share_difficulty=3, difficulty=4):
+        """
+        @param range_size: <int> Number of proofs per assignment
+        @param share_difficulty: <int> Leading zeros of a share
+        @param difficulty: <int> Leading zeros of a block's proof
+        """
+
+        self.range_size = range_size
+        self.share_difficulty = share_difficulty
+        self.difficulty = difficulty
+
+        self.job = 0
+        self.prev_hash = None
+        self.next_proof = 0
+
+        self.ranges = {}  # worker: [(start, end)] assigned in the current job
+        self.submitted = set()  # proofs submitted in the current job
+        self.workers = {}  # worker: {shares: <int>, blocks: <int>, stale: <int>, invalid: <int>, assigned: <int>}
+
+    def new_work(self, prev_hash):
+        """
+        Start a job for a new tip, forgetting the ranges of the previous one
+
+        @param prev_hash: <str> Hash of the last block's header
+
+        @return: <int> Id of the job
+        """
+
+        self.job += 1
+        self.prev_hash = prev_hash
+        self.next_proof = 0
+        self.ranges = {}
+        self.submitted = set()
+
+        return self.job
+
+    def stats(self, worker):
+        if worker not in self.workers:
+            self.workers[worker] = {'shares': 0, 'blocks': 0, 'stale': 0, 'invalid': 0, 'assigned': 0}
+        return self.workers[worker]
+
+    def assign(self, worker):
+        """
+        Hand the next range of proofs of the current job to a worker
+
+        @param worker: <str> Identifier of the worker
+
+        @return: <dict> Work of format: {job, prev_hash, start, end, share_difficulty}
+        """
+
+        start, end = self.next_proof, self.next_proof + self.range_size
+        self.next_proof = end
+
+        self.ranges.setdefault(worker, []).append((start, end))
+        self.stats(worker)['assigned'] += self.range_size
+
+        return {
+            'job': self.job,
+            'prev_hash': self.prev_hash,
+            'start': start,
+            'end': end,
+            'share_difficulty': self.share_difficulty
+        }
+
+    def submit(self, worker, job, proof):
+        """
+        Account a proof found by a worker
+
+        @param worker: <str> Identifier of the worker
+        @param job: <int> Id of the job the proof was found for
+        @param proof: <int>
+
+        @return: <str> 'block', 'share', 'stale' (older job or already submitted) or 'invalid'
+        """
+
+        stats = self.stats(worker)
+
+        if job != self.job or proof in self.submitted:
+            stats['stale'] += 1
+            return 'stale'
+
+        # Only proofs of the worker's own ranges count, so nobody gets paid for the work of others
+        in_range = any(start <= proof < end for start, end in self.ranges.get(worker, []))
+        if not in_range or not Blockchain.valid_proof(self.prev_hash, proof, self.share_difficulty):
+            stats['invalid'] += 1
+            return 'invalid'
+
+        self.submitted.add(proof)
+        stats['shares'] += 1
+
+        if Blockchain.valid_proof(self.prev_hash, proof, self.difficulty):
+            stats['blocks'] += 1
+            return 'block'
+
+        return 'share'
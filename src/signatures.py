@@ -0,0 +1,155 @@
+import os
+import threading
+import multiprocessing
+from hashlib import sha256
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from ecdsa import VerifyingKey, SECP256k1, BadSignatureError
+from ecdsa.keys import MalformedPointError
+
+
+@lru_cache(maxsize=1024)
+def _verifying_key(address):
+    return VerifyingKey.from_string(bytes.fromhex(address), curve=SECP256k1)
+
+
+def verify_signature(address, signature, tx_hash):
+    """
+    Determines whether a signature of a transaction hash was made by the owner of an address
+
+    @param address: <str> Public key of the signer (hex)
+    @param signature: <str> Signature (hex)
+    @param tx_hash: <str> Hash of the transaction
+
+    @return: <bool>
+    """
+
+    try:
+        return _verifying_key(address).verify(bytes.fromhex(signature), tx_hash.encode(), hashfunc=sha256)
+    except (BadSignatureError, MalformedPointError, ValueError, TypeError, AttributeError):
+        return False
+
+
+def _verify_chunk(chunk):
+    return [verify_signature(*item) for item in chunk]
+
+
+class SignatureVerifier(object):
+    """
+    Verifies transaction signatures in batches
+
+    - Transactions whose signature was already verified are remembered in an LRU cache (by hash and signature,
+      the hash doesn't cover the signature), so transactions verified when entering the transaction pool
+      aren't verified again with their block
+    - Large batches are split in chunks and verified across a process pool
+    """
+
+    def __init__(self, processes=None, cache_size=100000, min_parallel=32, chunk_size=16):
+        """
+        @param processes: <int> Size of the process pool (default: number of CPUs, 0 disables the pool)
+        @param cache_size: <int> Number of verified signatures to remember
+        @param min_parallel: <int> Smallest number of signatures worth sending to the process pool
+        @param chunk_size: <int> Number of signatures verified per task in the pool
+        """
+
+        self.processes = os.cpu_count() if processes is None else processes
+        self.cache_size = cache_size
+        self.min_parallel = min_parallel
+        self.chunk_size = chunk_size
+
+        self.cache = OrderedDict()  # (tx hash, signature): True
+        self.lock = threading.Lock()
+        self.pool = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(tx_hash, tx):
+        """
+        @return: (<str>, <str>) Cache key of a signed transaction, another signature of the same transaction is another key
+        """
+
+        signature = tx.get('signature')
+        return tx_hash, signature if isinstance(signature, str) else None
+
+    def verify(self, tx_hash, tx):
+        """
+        @param tx_hash: <str> Hash of the transaction (without its signature)
+        @param tx: <dict> Signed transaction
+
+        @return: <bool> True if the transaction was signed by its sender
+        """
+
+        return self.verify_batch([(tx_hash, tx)])[0]
+
+    def verify_batch(self, items):
+        """
+        @param items: [(<str>, <dict>)] Hashes and signed transactions
+
+        @return: [<bool>] True for every transaction signed by its sender
+        """
+
+        results = [True] * len(items)
+        todo = []
+
+        with self.lock:
+            for i, (tx_hash, tx) in enumerate(items):
+                key = self.key(tx_hash, tx)
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    todo.append(i)
+
+        if not todo:
+            return results
+
+        args = [(items[i][1].get('sender'), items[i][1].get('signature'), items[i][0]) for i in todo]
+
+        if self.processes and len(args) >= self.min_parallel:
+            chunks = [args[i:i + self.chunk_size] for i in range(0, len(args), self.chunk_size)]
+            verified = [valid for chunk in self.get_pool().map(_verify_chunk, chunks) for valid in chunk]
+        else:
+            verified = _verify_chunk(args)
+
+        with self.lock:
+            for i, valid in zip(todo, verified):
+                results[i] = valid
+
+                # Only remember valid signatures, so nobody can fill the cache with garbage
+                if valid:
+                    self.cache[self.key(*items[i])] = True
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+
+        return results
+
+    def trust(self, items):
+        """
+        Remember transactions as verified without verifying them (eg: verified by us before a restart)
+
+        @param items: [(<str>, <dict>)] Hashes and signed transactions
+        """
+
+        with self.lock:
+            for tx_hash, tx in items:
+                key = self.key(tx_hash, tx)
+                self.cache[key] = True
+                self.cache.move_to_end(key)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+    def get_pool(self):
+        if self.pool is None:
+            # Nodes are multithreaded, forking them isn't safe
+            self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,213 @@
+import heapq
+import threading
+from time import time
+from random import Random
+
+from mesh.links import VirtualLink
+from mesh.node import Node as NetworkComponent
+
+
+class SimulatedNetwork(threading.Thread):
+    """
+    In-process broadcast medium that stands in for the UDP network
+
+    - Every packet sent on one SimulatedLink is delivered to every other link on the network
+    - Each delivery is delayed by a configurable latency (+/- jitter) and by the sender's bandwidth
+    - Each delivery can be dropped with a configurable loss probability
+    - All random draws come from a seeded RNG so runs with the same seed make the same decisions
+    """
+
+    def __init__(self, latency=0.01, jitter=0.0, loss=0.0, bandwidth=None, seed=0):
+        """
+        @param latency: <float> One-way delay of every delivery in seconds
+        @param jitter: <float> Maximum random deviation from the latency in seconds
+        @param loss: <float> Probability (0 to 1) that a delivery is dropped
+        @param bandwidth: <int> Upload bandwidth of every link in bytes per second (None for unlimited)
+        @param seed: <int> Seed of the RNG used for loss and jitter
+        """
+        threading.Thread.__init__(self, daemon=True)
+
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.bandwidth = bandwidth
+
+        self.random = Random(seed)
+        self.links = []
+
+        # Deliveries waiting for their time: (deliver_at, sequence number, link, packet)
+        self.pending = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.keep_listening = True
+
+        self.stats = {
+            'packets_sent': 0,
+            'packets_delivered': 0,
+            'packets_dropped': 0,
+            'bytes_sent': 0,
+            'bytes_delivered': 0
+        }
+
+    def link(self, name='sim0'):
+        """
+        Create a new link attached to this network
+
+        @param name: <str> Name of the link
+
+        @return: <SimulatedLink>
+        """
+
+        link = SimulatedLink(self, name=name)
+        with self.condition:
+            self.links.append(link)
+
+        return link
+
+    def spawn(self, node_class, name, blockchain=None, address='127.0.0.1', **kwargs):
+        """
+        Start a node of the given class on a new link of this network
+
+        @param node_class: <class> Node, BlockchainNode, MinerNode or SPVNode
+        @param name: <str> Name of the node
+        @param blockchain: <Blockchain> Initial blockchain of the node
+        @param address: <str> Address used in the node's identifier
+        @param kwargs: Other arguments of the node (eg: address_book)
+
+        @return: <Node>
+        """
+
+        kwargs.setdefault('network_class', SimulatedComponent)
+        return node_class(name=name, blockchain=blockchain, links=[self.link(name)], address=address, **kwargs)
+
+    def reset_stats(self):
+        with self.condition:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    # Threading
+    def run(self):
+        while self.keep_listening:
+            with self.condition:
+                while self.keep_listening and (not self.pending or self.pending[0][0] > time()):
+                    timeout = self.pending[0][0] - time() if self.pending else None
+                    self.condition.wait(timeout)
+
+                if not self.keep_listening:
+                    return
+
+                deliver_at, _, link, packet = heapq.heappop(self.pending)
+                self.stats['packets_delivered'] += 1
+                self.stats['bytes_delivered'] += len(packet)
+
+            link.deliver(packet)
+
+    def stop(self):
+        with self.condition:
+            self.keep_listening = False
+            self.condition.notify()
+
+        if self.is_alive():
+            self.join()
+
+    # I/O
+    def transmit(self, sender, packet):
+        """
+        Schedule the delivery of a packet to every link except the sender
+
+        @param sender: <SimulatedLink> Link the packet was sent on
+        @param packet: <bytes>
+        """
+
+        with self.condition:
+            now = time()
+
+            # The sender's uplink transmits one packet at a time
+            if self.bandwidth:
+                sender.busy_until = max(now, sender.busy_until) + len(packet) / self.bandwidth
+                sent_at = sender.busy_until
+            else:
+                sent_at = now
+
+            self.stats['packets_sent'] += 1
+            self.stats['bytes_sent'] += len(packet)
+
+            for link in self.links:
+                if link is sender or not link.keep_listening:
+                    continue
+
+                if self.loss and self.random.random() < self.loss:
+                    self.stats['packets_dropped'] += 1
+                    continue
+
+                delay = self.latency
+                if self.jitter:
+                    delay = max(0, delay + self.random.uniform(-self.jitter, self.jitter))
+
+                heapq.heappush(self.pending, (sent_at + delay, self.sequence, link, packet))
+                self.sequence += 1
+
+            self.condition.notify()
+
+
+class SimulatedLink(VirtualLink):
+    """
+    Link attached to a SimulatedNetwork, used in place of a UDPLink by a Node
+    """
+
+    def __init__(self, network, name='sim0'):
+        VirtualLink.__init__(self, name=name)
+
+        self.network = network
+        self.busy_until = 0
+
+    def log(self, *args):
+        # Dozens of links are started in a simulation, keep them quiet
+        pass
+
+    # I/O
+    def send(self, packet, mac_addr=VirtualLink.broadcast_addr):
+        if self.keep_listening:
+            self.network.transmit(self, packet)
+
+    def deliver(self, packet):
+        """
+        Place a packet in the receive queue of every address listening on this link (like UDPLink.run)
+
+        @param packet: <bytes>
+        """
+
+        if self.keep_listening:
+            for mac_addr, recv_queue in list(self.inq.items()):
+                # Nothing reads the broadcast queue, don't let it grow forever
+                if mac_addr != self.broadcast_addr:
+                    recv_queue.put(packet)
+
+
+class SimulatedComponent(NetworkComponent):
+    """
+    Network component of a node on a SimulatedNetwork
+
+    mesh's Node sleeps 10ms after polling each link, capping a node at about 100 packets per second
+    whatever the simulated bandwidth. This one blocks on the link's queue instead, so packets are read as soon as they arrive
+    """
+
+    # Seconds a read waits for a packet before checking whether to stop
+    timeout = 0.1
+
+    def log(self, *args):
+        # One per node of a simulation, keep them quiet like their links
+        pass
+
+    def run(self):
+        if self.program:
+            self.program.start()
+
+        while self.keep_listening:
+            for interface in self.interfaces:
+                packet = interface.recv(self.mac_addr if not self.promiscuous else '00:00:00:00:00:00',
+                                        timeout=self.timeout / len(self.interfaces))
+                if packet:
+                    self.recv(packet, interface)
+
+        self.log('Stopped listening.')
@@ -0,0 +1,124 @@
+import json
+from hashlib import sha256
+
+from .blockchain import Blockchain
+
+
+def load_checkpoints(filename):
+    """
+    Load signed-off checkpoints
+
+    @param filename: <str> JSON file of format: {"<block index>": "<hash of the block's header>"}
+        The checkpoint of a snapshot's tip also records the hash of its transactions:
+        {"<block index>": {"hash": "<hash of the block's header>", "tx_info": "<hash of the snapshot's tx_info>"}}
+
+    @return: <dict> Block index: hash of the block's header
+    """
+
+    with open(filename) as infile:
+        return {
+            int(index): checkpoint['hash'] if isinstance(checkpoint, dict) else checkpoint
+            for index, checkpoint in json.load(infile).items()
+        }
+
+
+def load_tx_info_hashes(filename):
+    """
+    @param filename: <str> Checkpoints file (see load_checkpoints)
+
+    @return: <dict> Block index: hash of the tx_info of the snapshot up to it, for the checkpoints that have one
+    """
+
+    with open(filename) as infile:
+        return {
+            int(index): checkpoint['tx_info']
+            for index, checkpoint in json.load(infile).items() if isinstance(checkpoint, dict) and 'tx_info' in checkpoint
+        }
+
+
+def tx_info_hash(tx_info):
+    """
+    @param tx_info: <dict> Transactions of a snapshot
+
+    @return: <str> Hash of their canonical encoding (sorted keys), computed without building the whole string
+    """
+
+    digest = sha256()
+    for chunk in json.JSONEncoder(sort_keys=True).iterencode(tx_info):
+        digest.update(chunk.encode())
+
+    return digest.hexdigest()
+
+
+def create_snapshot(blockchain, height=None):
+    """
+    Create an assumed-valid snapshot of a blockchain
+
+    @param blockchain: <Blockchain> Fully validated blockchain
+    @param height: <int> Index of the last block in the snapshot (default: the tip)
+
+    @return: <dict>
+        Snapshot of format: {
+            height: <int>
+            tip: <str>  # hash of the last block's header
+            headers: [<block header>]
+            tx_info: <dict>  # transactions of the blocks up to height
+        }
+    """
+
+    chain = blockchain.chain[:height or len(blockchain.chain)]
+    if len(chain) < blockchain.pruned_height:
+        raise ValueError(f'Blocks up to {blockchain.pruned_height} were pruned, cannot snapshot height {len(chain)}')
+
+    # Every known transaction except the ones of later blocks and of the transaction pool
+    excluded = set(blockchain.transaction_pool)
+    for block in blockchain.chain[len(chain):]:
+        excluded.update(block.get('transactions', []))
+
+    tx_info = {tx_hash: tx for tx_hash, tx in blockchain.tx_info.items() if tx_hash not in excluded}
+
+    headers = [block['header'] for block in chain]
+
+    return {
+        'height': len(headers),
+        'tip': Blockchain.hash(headers[-1]),
+        'headers': headers,
+        'tx_info': tx_info
+    }
+
+
+def load_snapshot(snapshot, checkpoints, tx_info_hashes):
+    """
+    Bootstrap a blockchain from a snapshot whose tip is a checkpoint
+
+    - Header links, indices and timestamps are verified, Proof of Work is assumed valid
+    - Transactions must match the hash recorded with the checkpoint, as nothing else in the snapshot commits to them
+    - Blocks of the snapshot only have their header, the rest of the chain is synced from peers
+
+    @param snapshot: <dict> Snapshot (see create_snapshot)
+    @param checkpoints: <dict> Block index: hash of the block's header
+    @param tx_info_hashes: <dict> Block index: hash of the snapshot's tx_info (see load_tx_info_hashes)
+
+    @return: <Blockchain>
+    """
+
+    height = snapshot['height']
+    headers = snapshot['headers']
+
+    if checkpoints.get(height) != snapshot['tip']:
+        raise ValueError(f'Snapshot tip at height {height} is not a checkpoint')
+
+    if len(headers) != height or Blockchain.hash(headers[-1]) != snapshot['tip']:
+        raise ValueError('Snapshot headers don\'t lead to its tip')
+
+    if not Blockchain.valid_headers(headers, assume_valid=height) or not Blockchain.matches_checkpoints(headers, checkpoints):
+        raise ValueError('Snapshot headers are not valid')
+
+    if height not in tx_info_hashes:
+        raise ValueError(f'Checkpoint at height {height} has no hash of the snapshot\'s transactions')
+
+    if tx_info_hash(snapshot['tx_info']) != tx_info_hashes[height]:
+        raise ValueError('Snapshot transactions don\'t match the checkpoint')
+
+    chain = [{'header': header} for header in headers]
+    return Blockchain(chain, snapshot['tx_info'], pruned_height=height)
@@ -0,0 +1,224 @@
+import json
+import codecs
+from functools import partial
+
+from .blockchain import Blockchain
+
+
+class JSONStream(object):
+    """
+    Decodes a large JSON document a value at a time, without reading the whole file
+
+    - Only the containers being walked through are parsed by hand (`[`, `{`, `,`, `:`, `]`, `}`),
+      the values inside them are decoded with the json module
+    - At most one chunk plus the value being decoded is held in memory
+    """
+
+    def __init__(self, infile, offset=0, chunk_size=1 << 20):
+        """
+        @param infile: <file> File opened in binary mode
+        @param offset: <int> Byte offset to start reading from
+        @param chunk_size: <int> Bytes read at a time
+        """
+
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+
+        self.infile.seek(offset)
+        self.offset = offset  # byte offset of the start of the buffer
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def tell(self):
+        """
+        @return: <int> Byte offset of the current position in the file
+        """
+
+        return self.offset + len(self.buffer[:self.pos].encode())
+
+    def fill(self):
+        """
+        Read the next chunk, dropping what was already decoded
+
+        @return: <bool> False at the end of the file
+        """
+
+        if self.eof:
+            return False
+
+        self.offset += len(self.buffer[:self.pos].encode())
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+
+        chunk = self.infile.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer += self.utf8.decode(chunk, final=self.eof)
+
+        return not self.eof
+
+    def peek(self):
+        """
+        @return: <str> Next character that isn't whitespace, '' at the end of the file
+        """
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if char == '' or char not in chars:
+            raise ValueError(f'Expected one of {chars!r} at byte {self.tell()}, got {char!r}')
+
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        @return: Next JSON value
+        """
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value continues in the next chunk
+                if self.fill():
+                    continue
+                raise
+
+            # A number might continue in the next chunk (eg: '3' or '3.' of '3.25' decodes as 3)
+            if isinstance(value, (int, float)) and all(char in '0123456789+-.eE' for char in self.buffer[end:]) and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def items(self):
+        """
+        Walk through an object, yielding its keys and values
+
+        The consumer decodes the value of a key (with `value`, `items` or `elements`),
+        a value it doesn't decode is skipped
+
+        @return: <generator> (<str> key, <JSONStream>) pairs
+        """
+
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+
+            start = self.pos, self.offset
+            yield key, self
+
+            # The consumer didn't decode the value
+            if (self.pos, self.offset) == start:
+                self.value()
+
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        Walk through an array, decoding its elements one at a time
+
+        @return: <generator>
+        """
+
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+
+            if self.expect(',]') == ']':
+                return
+
+
+def load_tx_info(filename, offset):
+    """
+    Load the tx_info object of a blockchain file
+
+    @param filename: <str> Blockchain file
+    @param offset: <int> Byte offset of the tx_info object in the file
+
+    @return: <dict> a mapping of transaction hashes to transaction information
+    """
+
+    with open(filename, 'rb') as infile:
+        stream = JSONStream(infile, offset)
+        return {tx_hash: tx.value() for tx_hash, tx in stream.items()}
+
+
+def load_blockchain(filename, headers_only=False):
+    """
+    Load a blockchain file (see Blockchain.save) incrementally
+
+    - Blocks are decoded one at a time while the file is streamed
+    - tx_info isn't read, it is only loaded from the file the first time it is used
+      (unless it comes before the chain in the file)
+
+    @param filename: <str> Blockchain file
+    @param headers_only: <bool> Only keep the block headers (eg: for an SPV node)
+
+    @return: <Blockchain>
+    """
+
+    chain = None
+    tx_info = None
+    pruned_height = None
+
+    with open(filename, 'rb') as infile:
+        stream = JSONStream(infile)
+
+        for key, value in stream.items():
+            if key == 'chain':
+                chain = []
+                for block in value.elements():
+                    if headers_only:
+                        # Files of SPV nodes already only have headers
+                        block = block.get('header', block)
+                    chain.append(block)
+
+            elif key == 'pruned_height':
+                pruned_height = value.value()
+
+            elif key == 'tx_info':
+                if chain is not None:
+                    tx_info = partial(load_tx_info, filename, stream.tell())
+
+                    # Nothing else is needed from the rest of the file
+                    break
+
+                # The chain comes after it (not a file of Blockchain.save), it has to be read to get past it
+                if not headers_only:
+                    tx_info = value.value()
+
+    if chain is None:
+        raise ValueError(f'{filename} has no chain')
+
+    if headers_only:
+        return Blockchain(chain)
+
+    # Pruned blocks only have a header
+    if pruned_height is None:
+        pruned_height = next((i for i, block in enumerate(chain) if 'transactions' in block), len(chain))
+
+    return Blockchain(chain, tx_info, pruned_height)
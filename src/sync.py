@@ -0,0 +1,222 @@
+from time import time
+from collections import deque
+
+from .blockchain import Blockchain
+
+
+class BlockDownloader(object):
+    """
+    Downloads the blocks of an already verified header chain from several peers at once
+
+    - The missing blocks are split into windows of consecutive indices
+    - Each peer gets up to `max_inflight` windows at a time, fastest peers first
+    - Every body is checked against its verified header as soon as it arrives
+    - Requests which take longer than `timeout` are handed to another peer
+    """
+
+    def __init__(self, headers, start, window=16, max_inflight=2, timeout=2):
+        """
+        @param headers: [<dict>] Verified block headers of the chain to download
+        @param start: <int> Index of the first block to download (blocks before it are already ours)
+        @param window: <int> Number of blocks per request
+        @param max_inflight: <int> Number of requests a single peer can have at once
+        @param timeout: <float> Seconds before a request is considered stalled
+        """
+
+        self.headers = headers
+        self.start = start
+        self.window = window
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+
+        self.blocks = {}  # index: block
+        self.tx_info = {}
+
+        self.pending = deque()
+        self.queue(range(start, len(headers) + 1))
+        self.inflight = {}  # request id: {peer: <str>, indices: [<int>], sent: <time>}
+        self.peer_stats = {}  # peer: {throughput: <float>, inflight: <int>, stalls: <int>}
+        self.request_id = 0
+
+    @property
+    def height(self):
+        return len(self.headers)
+
+    @property
+    def complete(self):
+        return len(self.blocks) == self.height - self.start + 1
+
+    def queue(self, indices):
+        """
+        Add blocks to download to the pending windows
+
+        @param indices: [<int>] Ordered indices of the blocks
+        """
+
+        indices = list(indices)
+        for i in range(0, len(indices), self.window):
+            self.pending.append(indices[i:i + self.window])
+
+    def extend(self, headers, start):
+        """
+        Switch to another verified header chain (eg: a block was mined while syncing),
+        keeping the downloaded and requested blocks whose headers didn't change
+
+        @param headers: [<dict>] Verified block headers of the chain to download
+        @param start: <int> Index of the first block to download
+        """
+
+        # Headers are hash linked, once two chains differ at an index they differ at every later one
+        low, high = 0, min(len(self.headers), len(headers))
+        while low < high:
+            mid = (low + high) // 2
+            if Blockchain.hash(self.headers[mid]) == Blockchain.hash(headers[mid]):
+                low = mid + 1
+            else:
+                high = mid
+        unchanged = low  # blocks up to this index are the same in both chains
+
+        self.headers = headers
+        self.start = start
+
+        self.blocks = {index: block for index, block in self.blocks.items() if start <= index <= unchanged}
+        self.tx_info = {
+            tx_hash: self.tx_info[tx_hash] for block in self.blocks.values() for tx_hash in block['transactions']
+        }
+
+        # Requests of blocks that changed are dropped, their answers won't match the new headers
+        for request_id, request in list(self.inflight.items()):
+            if request['indices'][0] < start or request['indices'][-1] > unchanged:
+                self.inflight.pop(request_id)
+                self.stats(request['peer'])['inflight'] -= 1
+
+        requested = {index for request in self.inflight.values() for index in request['indices']}
+        self.pending = deque()
+        self.queue(index for index in range(start, len(headers) + 1) if index not in self.blocks and index not in requested)
+
+    def stats(self, peer):
+        if peer not in self.peer_stats:
+            # Unknown peers start with an infinite throughput so they are tried right away
+            self.peer_stats[peer] = {'throughput': float('inf'), 'inflight': 0, 'stalls': 0}
+        return self.peer_stats[peer]
+
+    def assign(self, peer_heights, peer_pruned=None, now=None):
+        """
+        Hand the pending windows to the fastest peers with free slots
+
+        @param peer_heights: <dict> peer: height of the peer's blockchain
+        @param peer_pruned: <dict> peer: index up to which the peer pruned its blocks
+        @param now: <time>
+
+        @return: [(<str>, <int>, [<int>])] (peer, request id, indices) of the requests to send
+        """
+
+        now = time() if now is None else now
+        peer_pruned = peer_pruned or {}
+        requests = []
+
+        peers = sorted(peer_heights, key=lambda peer: self.stats(peer)['throughput'], reverse=True)
+
+        for _ in range(len(self.pending)):
+            indices = self.pending.popleft()
+
+            # Skip blocks that came in late from a stalled peer
+            indices = [index for index in indices if index not in self.blocks]
+            if not indices:
+                continue
+
+            for peer in peers:
+                stats = self.stats(peer)
+                has_blocks = (peer_pruned.get(peer) or 0) < indices[0] and (peer_heights[peer] or 0) >= indices[-1]
+                if stats['inflight'] < self.max_inflight and has_blocks:
+                    self.request_id += 1
+                    self.inflight[self.request_id] = {'peer': peer, 'indices': indices, 'sent': now}
+                    stats['inflight'] += 1
+                    requests.append((peer, self.request_id, indices))
+                    break
+            else:
+                # Nobody can take it right now
+                self.pending.append(indices)
+
+        return requests
+
+    def receive(self, peer, request_id, blocks, tx_info, size, now=None):
+        """
+        Validate blocks received from a peer against the verified headers
+
+        @param peer: <str> Identifier of the peer
+        @param request_id: <int> Id of the request the peer answered
+        @param blocks: [<dict>] Blocks sent by the peer
+        @param tx_info: <dict> Transactions of those blocks
+        @param size: <int> Size of the message in bytes
+        @param now: <time>
+
+        @return: <bool> True if every block was valid
+        """
+
+        now = time() if now is None else now
+        request = self.inflight.pop(request_id, None)
+        stats = self.stats(peer)
+
+        if request and request['peer'] == peer:
+            stats['inflight'] -= 1
+
+            # Exponential moving average of the peer's throughput
+            elapsed = max(now - request['sent'], 1e-6)
+            throughput = size / elapsed
+            stats['throughput'] = throughput if stats['throughput'] == float('inf') else (stats['throughput'] + throughput) / 2
+        elif request:
+            self.inflight[request_id] = request
+
+        valid = True
+        for block in blocks:
+            index = block['header']['index'] if isinstance(block, dict) and 'header' in block else None
+
+            if index is None or not self.start <= index <= self.height:
+                valid = False
+                continue
+
+            if index not in self.blocks and Blockchain.valid_block(block, self.headers[index - 1], tx_info):
+                self.blocks[index] = block
+                for tx_hash in block['transactions']:
+                    self.tx_info[tx_hash] = tx_info[tx_hash]
+            elif index not in self.blocks:
+                valid = False
+
+        # Anything the peer didn't deliver goes back to the queue
+        if request:
+            missing = [index for index in request['indices'] if index not in self.blocks]
+            if missing and request_id not in self.inflight:
+                self.pending.appendleft(missing)
+
+        return valid
+
+    def check_stalls(self, now=None):
+        """
+        Put the windows of stalled requests back in the queue for another peer
+
+        @return: [<str>] Peers which stalled
+        """
+
+        now = time() if now is None else now
+        stalled = []
+
+        for request_id, request in list(self.inflight.items()):
+            if now - request['sent'] > self.timeout:
+                self.inflight.pop(request_id)
+                self.pending.appendleft(request['indices'])
+
+                stats = self.stats(request['peer'])
+                stats['inflight'] -= 1
+                stats['stalls'] += 1
+                stats['throughput'] = 0 if stats['throughput'] == float('inf') else stats['throughput'] / 2
+                stalled.append(request['peer'])
+
+        return stalled
+
+    def chain(self):
+        """
+        @return: [<dict>] Downloaded blocks ordered by index
+        """
+
+        return [self.blocks[index] for index in range(self.start, self.height + 1)]
@@ -0,0 +1,70 @@
+import os
+from time import time
+from hashlib import sha256
+
+from ecdsa import SigningKey, SECP256k1
+
+from .blockchain import Blockchain
+
+
+class Wallet(object):
+    """
+    Key pair of a node, its address is its public key
+    """
+
+    def __init__(self, signing_key=None):
+        self.signing_key = signing_key or SigningKey.generate(curve=SECP256k1)
+
+    @property
+    def address(self):
+        return self.signing_key.get_verifying_key().to_string().hex()
+
+    @classmethod
+    def load(cls, filename='wallet.pem'):
+        """
+        Load the wallet stored in a file, or create and store a new one if there is none
+        """
+
+        try:
+            with open(filename) as infile:
+                return cls(SigningKey.from_pem(infile.read()))
+        except FileNotFoundError:
+            wallet = cls()
+            wallet.save(filename)
+            return wallet
+
+    def save(self, filename='wallet.pem'):
+        # Only readable by its owner, it holds the private key
+        with open(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as outfile:
+            outfile.write(self.signing_key.to_pem())
+
+    def sign(self, tx_hash):
+        """
+        @param tx_hash: <str> Hash of the transaction (without its signature)
+
+        @return: <str> Signature (hex)
+        """
+
+        return self.signing_key.sign(tx_hash.encode(), hashfunc=sha256).hex()
+
+    def create_transaction(self, recipient, amount, previous_hash):
+        """
+        Create a transaction sent and signed by this wallet
+
+        @param recipient: <str> Address of recipient
+        @param amount: <int> Amount
+        @param previous_hash: <str> hash of the previous transaction used
+
+        @return: <dict> Signed transaction
+        """
+
+        tx = {
+            'previous_hash': previous_hash,
+            'sender': self.address,
+            'recipient': recipient,
+            'amount': amount,
+            'timestamp': time()
+        }
+        tx['signature'] = self.sign(Blockchain.tx_hash(tx))
+
+        return tx
@@ -0,0 +1,82 @@
+from src.blockchain import Blockchain
+from src.signatures import SignatureVerifier
+from src.wallet import Wallet
+
+
+def mine(blockchain, recipient):
+    """
+    Add a block (with the transaction pool) whose reward goes to recipient, its Proof of Work isn't checked here
+
+    @return: <str> Hash of the reward
+    """
+
+    reward = Blockchain.tx_hash(blockchain.add_reward(recipient))
+    blockchain.add_block(proof=0)
+    blockchain.transaction_pool = []
+
+    return reward
+
+
+def test_spend_a_reward():
+    wallet = Wallet()
+    blockchain = Blockchain(verifier=SignatureVerifier(processes=0))
+    reward = mine(blockchain, wallet.address)
+
+    assert blockchain.verify_and_add_transaction(**wallet.create_transaction('recipient', Blockchain.reward, reward))
+    assert not blockchain.verify_and_add_transaction(**wallet.create_transaction('recipient', Blockchain.reward + 1, reward))
+
+    # Somebody else's reward
+    assert not blockchain.verify_and_add_transaction(**Wallet().create_transaction('recipient', 1, reward))
+
+
+def test_no_coins_out_of_nothing():
+    wallet = Wallet()
+    blockchain = Blockchain(verifier=SignatureVerifier(processes=0))
+
+    # Signed, but doesn't spend anything
+    assert not blockchain.verify_and_add_transaction(**wallet.create_transaction('recipient', 10, '0'))
+
+    # Rewards only come from add_reward
+    tx = wallet.create_transaction('recipient', 10, '0')
+    assert not blockchain.valid_transaction({**tx, 'sender': '0'})
+
+    assert blockchain.transaction_pool == []
+
+
+def test_prune_drops_spent_transactions():
+    wallet = Wallet()
+    blockchain = Blockchain(verifier=SignatureVerifier(processes=0))
+
+    reward = mine(blockchain, wallet.address)
+    unspent = mine(blockchain, wallet.address)
+    tx = blockchain.verify_and_add_transaction(**wallet.create_transaction('recipient', 1, reward))
+    mine(blockchain, 'miner')
+
+    # The spender's block is kept whole, the reward is spent
+    assert blockchain.prune(2) == 2
+    assert reward not in blockchain.tx_info
+    assert unspent in blockchain.tx_info
+    assert Blockchain.tx_hash(tx) in blockchain.tx_info
+
+
+def test_prune_drops_transactions_spent_after_their_block_was_pruned():
+    wallet = Wallet()
+    blockchain = Blockchain(verifier=SignatureVerifier(processes=0))
+
+    reward = mine(blockchain, wallet.address)
+    mine(blockchain, 'miner')
+    assert blockchain.prune(1) == 2
+    assert reward in blockchain.tx_info
+
+    # Pending spends don't count
+    blockchain.verify_and_add_transaction(**wallet.create_transaction('recipient', 1, reward))
+    blockchain.prune(1)
+    assert reward in blockchain.tx_info
+
+    tx_info = len(blockchain.tx_info)
+    for _ in range(3):
+        mine(blockchain, 'miner')
+        blockchain.prune(1)
+
+    assert reward not in blockchain.tx_info
+    assert len(blockchain.tx_info) <= tx_info + 3
@@ -0,0 +1,91 @@
+import copy
+import json
+
+from src.blockchain import Blockchain
+from src.cache import LRUCache, BlockCache, same
+
+
+def grow(blockchain, height, recipient='miner'):
+    while len(blockchain.chain) < height:
+        blockchain.add_reward(recipient)
+        blockchain.add_block(proof=0)
+
+    return blockchain
+
+
+def test_same():
+    block = {'index': 1}
+
+    assert same(block, block)
+    assert not same(block, {'index': 1})
+
+    # Numbers by value, even when they aren't the same objects
+    assert same(10 ** 20, int('1' + '0' * 20))
+    assert not same(1, 2)
+
+    # Tuples element-wise
+    assert same((block, 10 ** 20), (block, int('1' + '0' * 20)))
+    assert not same((block, 1), (copy.copy(block), 1))
+    assert not same((block,), (block, 1))
+
+
+def test_lru_get_is_a_miss_once_the_source_is_replaced():
+    cache = LRUCache()
+    block = {'index': 1}
+    cache.put(1, block, 'encoded')
+
+    assert cache.get(1, block) == 'encoded'
+
+    # Equal, but a new object (eg: the block was replaced by a fork)
+    assert cache.get(1, {'index': 1}) is None
+    assert cache.get(2, block) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1, 'a')
+    cache.put('b', 1, 'b')
+
+    # Used, so b is the least recently used
+    cache.get('a', 1)
+    cache.put('c', 1, 'c')
+
+    assert list(cache.entries) == ['a', 'c']
+
+
+def test_messages():
+    blockchain = grow(Blockchain(), 10)
+    cache = BlockCache(blockchain)
+
+    assert json.loads(cache.headers_message()) == {'headers': [block['header'] for block in blockchain.chain]}
+    assert json.loads(cache.chain_message()) == {'chain': blockchain.chain, 'tx_info': blockchain.tx_info}
+
+    blocks = blockchain.chain[2:4]
+    assert json.loads(cache.blocks_message(7, [3, 4, 11])) == {
+        'request': 7,
+        'blocks': blocks,
+        'tx_info': {tx_hash: blockchain.tx_info[tx_hash] for block in blocks for tx_hash in block['transactions']}
+    }
+
+
+def test_responses_follow_the_chain():
+    blockchain = grow(Blockchain(), 10)
+    cache = BlockCache(blockchain)
+
+    # Reused while the chain is the same, whatever the id of the request
+    headers = cache.headers_message()
+    assert cache.headers_message() is headers
+    assert cache.blocks_message(1, [5, 6]) == cache.blocks_message(1, [5, 6])
+    assert cache.responses.hits == 2
+
+    grow(blockchain, 11)
+    assert json.loads(cache.headers_message())['headers'][-1] == blockchain.chain[-1]['header']
+
+    # Blocks after 5 replaced by a fork
+    fork = grow(Blockchain(copy.deepcopy(blockchain.chain[:5]), copy.deepcopy(blockchain.tx_info)), 12, recipient='other')
+    blockchain.chain = blockchain.chain[:5] + fork.chain[5:]
+    blockchain.tx_info.update(fork.tx_info)
+
+    assert json.loads(cache.headers_message())['headers'] == [block['header'] for block in blockchain.chain]
+    assert json.loads(cache.blocks_message(1, [5, 6]))['blocks'] == blockchain.chain[4:6]
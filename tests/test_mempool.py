@@ -0,0 +1,105 @@
+import threading
+
+from src.mempool import MempoolJournal
+
+
+def transaction(i):
+    return {'sender': 'sender', 'recipient': 'recipient', 'amount': i}
+
+
+def test_replay(tmp_path):
+    filename = str(tmp_path / 'mempool.log')
+
+    journal = MempoolJournal(filename)
+    for i in range(5):
+        journal.add(f'tx{i}', transaction(i))
+    journal.remove(['tx1', 'tx3'])
+    journal.remove([])
+    journal.close()
+
+    journal = MempoolJournal(filename)
+    pending = journal.replay()
+    assert list(pending) == ['tx0', 'tx2', 'tx4']
+    assert pending['tx2'] == transaction(2)
+    assert journal.records == 6
+
+    # Appends to the replayed journal
+    journal.add('tx5', transaction(5))
+    journal.close()
+    assert list(MempoolJournal(filename).replay()) == ['tx0', 'tx2', 'tx4', 'tx5']
+
+
+def test_replay_without_a_journal(tmp_path):
+    assert MempoolJournal(str(tmp_path / 'mempool.log')).replay() == {}
+
+
+def test_torn_last_line(tmp_path):
+    filename = str(tmp_path / 'mempool.log')
+
+    journal = MempoolJournal(filename)
+    journal.add('tx0', transaction(0))
+    journal.add('tx1', transaction(1))
+    journal.close()
+
+    # A crash in the middle of a write
+    with open(filename, 'a') as outfile:
+        outfile.write('{"add": "tx2", "tx": {"sen')
+
+    journal = MempoolJournal(filename)
+    assert list(journal.replay()) == ['tx0', 'tx1']
+    assert journal.records == 2
+
+
+def test_compact(tmp_path):
+    filename = str(tmp_path / 'mempool.log')
+
+    journal = MempoolJournal(filename, compact_ratio=2, min_compact=4)
+    for i in range(4):
+        journal.add(f'tx{i}', transaction(i))
+    assert not journal.should_compact(4)
+
+    journal.remove(['tx0', 'tx1', 'tx2'])
+    assert journal.should_compact(1)
+
+    journal.compact(lambda: {'tx3': transaction(3)})
+    assert journal.records == 1
+
+    # Written after the rewrite
+    journal.add('tx4', transaction(4))
+    journal.close()
+
+    with open(filename) as infile:
+        assert len(infile.readlines()) == 2
+    assert list(MempoolJournal(filename).replay()) == ['tx3', 'tx4']
+
+
+def test_compaction_racing_with_adds(tmp_path):
+    filename = str(tmp_path / 'mempool.log')
+    journal = MempoolJournal(filename)
+    pool = {}
+    done = threading.Event()
+
+    def add():
+        # Pending before it's journaled, as Blockchain.verify_and_add_transaction does
+        for i in range(20000):
+            pool[f'tx{i}'] = transaction(i)
+            journal.add(f'tx{i}', transaction(i))
+
+            if i % 3 == 0:
+                pool.pop(f'tx{i}')
+                journal.remove([f'tx{i}'])
+        done.set()
+
+    def compact():
+        while not done.is_set():
+            journal.compact(lambda: dict(pool))
+
+    threads = [threading.Thread(target=add), threading.Thread(target=compact)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    # No transaction added or removed during a compaction is lost
+    assert MempoolJournal(filename).replay() == pool
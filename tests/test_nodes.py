@@ -0,0 +1,132 @@
+import copy
+import json
+
+import pytest
+
+from src.blockchain import Blockchain
+from src.nodes import BlockchainNode
+from src.simulator import SimulatedNetwork
+
+
+@pytest.fixture
+def network():
+    network = SimulatedNetwork()
+    network.start()
+    yield network
+    network.stop()
+
+
+@pytest.fixture
+def node(network):
+    node = network.spawn(BlockchainNode, 'node')
+    yield node
+    node.stop()
+
+
+def copy_of(blockchain):
+    return Blockchain(copy.deepcopy(blockchain.chain), copy.deepcopy(blockchain.tx_info))
+
+
+def mine(blockchain, recipient='miner'):
+    """
+    @return: <dict> Next block of the blockchain, with a valid Proof of Work
+    """
+
+    prev_hash = Blockchain.hash(blockchain.last_block['header'])
+
+    proof = 0
+    while not Blockchain.valid_proof(prev_hash, proof):
+        proof += 1
+
+    blockchain.add_reward(recipient)
+    return blockchain.add_block(proof, prev_hash)
+
+
+def receive(node, msg_type, message, sender='peer'):
+    packet = json.dumps({'type': msg_type, 'identifier': sender, 'message': json.dumps(message), 'target': ''})
+    node.recv(packet.encode(), None)
+
+
+def addblock(node, block, tx_info, height, sender='peer'):
+    receive(node, 'addblock', {'block': block, 'tx_info': tx_info, 'height': height}, sender)
+
+
+def version(node, sender):
+    receive(node, 'version', {'height': 1, 'pruned': 0, 'service': 'full'}, sender)
+
+
+def transactions(blockchain, block):
+    return {tx_hash: blockchain.tx_info[tx_hash] for tx_hash in block['transactions']}
+
+
+def test_addblock_on_top_of_the_tip(node):
+    blockchain = copy_of(node.blockchain)
+    block = mine(blockchain)
+
+    addblock(node, block, transactions(blockchain, block), 2)
+
+    assert node.blockchain.chain[-1] == block
+    assert node.admission.scores.get('peer') is None
+
+
+def test_invalid_block_on_top_of_the_tip(node):
+    blockchain = copy_of(node.blockchain)
+    block = mine(blockchain)
+
+    # Its transactions don't match the merkle root
+    tx_info = transactions(blockchain, block)
+    tx_info[block['transactions'][0]]['amount'] = 1000
+
+    addblock(node, block, tx_info, 2)
+
+    assert len(node.blockchain.chain) == 1
+    assert node.admission.scores['peer'] > 0
+    assert node.headers_request is None
+
+
+def test_block_not_on_top_of_the_tip(node):
+    blockchain = copy_of(node.blockchain)
+    mine(blockchain)
+    block = mine(blockchain)
+
+    # An honest peer ahead of us, or on another fork
+    addblock(node, block, transactions(blockchain, block), 3)
+
+    assert len(node.blockchain.chain) == 1
+    assert node.admission.scores.get('peer') is None
+
+
+def test_block_without_proof_of_work(node):
+    blockchain = copy_of(node.blockchain)
+    blockchain.add_reward('miner')
+    block = blockchain.add_block(proof=0)
+
+    addblock(node, block, transactions(blockchain, block), 2)
+
+    assert len(node.blockchain.chain) == 1
+    assert node.metrics.get('messages_dropped', reason='invalid', type='addblock') == 1
+
+
+def test_max_peers(node):
+    node.max_peers = 3
+    for i in range(5):
+        version(node, f'peer-{i}')
+
+    assert set(node.peers) == {'peer-0', 'peer-1', 'peer-2'}
+    assert node.address_book.get('peer-4') is None
+
+    # Known peers can still handshake again
+    version(node, 'peer-0')
+    assert node.metrics.get('messages_dropped', reason='rate_limited', type='version') is None
+
+
+def test_handshakes_of_unknown_peers_are_rate_limited(node):
+    burst = node.admission.handshake_limit[1]
+    for i in range(burst + 10):
+        version(node, f'peer-{i}')
+
+    assert len(node.peers) == burst
+    assert node.metrics.get('messages_dropped', reason='rate_limited', type='version') == 10
+
+    # Without a bucket for each of them
+    assert len(node.admission.buckets) == burst
@@ -0,0 +1,63 @@
+from src.blockchain import Blockchain
+from src.signatures import SignatureVerifier
+from src.wallet import Wallet
+
+
+def signed_transaction():
+    tx = Wallet().create_transaction('recipient', 10, 'previous')
+    return Blockchain.tx_hash(tx), tx
+
+
+def forged(tx):
+    # The hash of a transaction doesn't cover its signature, a forged copy has the same one
+    return {**tx, 'signature': '00' * 64}
+
+
+def test_verify():
+    tx_hash, tx = signed_transaction()
+    verifier = SignatureVerifier(processes=0)
+
+    assert verifier.verify(tx_hash, tx)
+    assert not verifier.verify(tx_hash, forged(tx))
+    assert not verifier.verify(tx_hash, {**tx, 'signature': ['not', 'hex']})
+
+
+def test_cache_hits_only_the_verified_signature():
+    tx_hash, tx = signed_transaction()
+    verifier = SignatureVerifier(processes=0)
+
+    assert verifier.verify(tx_hash, tx)
+    assert verifier.verify(tx_hash, tx)
+    assert (verifier.hits, verifier.misses) == (1, 1)
+
+    assert verifier.verify_batch([(tx_hash, forged(tx)), (tx_hash, tx)]) == [False, True]
+
+
+def test_trust_only_the_trusted_signature():
+    tx_hash, tx = signed_transaction()
+    verifier = SignatureVerifier(processes=0)
+
+    verifier.trust([(tx_hash, tx)])
+    assert verifier.verify(tx_hash, tx)
+    assert verifier.misses == 0
+
+    assert not verifier.verify(tx_hash, forged(tx))
+
+
+def test_invalid_signatures_are_not_cached():
+    tx_hash, tx = signed_transaction()
+    verifier = SignatureVerifier(processes=0)
+
+    assert not verifier.verify(tx_hash, forged(tx))
+    assert len(verifier.cache) == 0
+
+
+def test_process_pool():
+    items = [signed_transaction() for _ in range(4)]
+    items.append((items[0][0], forged(items[0][1])))
+
+    verifier = SignatureVerifier(processes=2, min_parallel=1, chunk_size=2)
+    try:
+        assert verifier.verify_batch(items) == [True, True, True, True, False]
+    finally:
+        verifier.close()
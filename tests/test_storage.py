@@ -0,0 +1,143 @@
+import io
+import json
+
+import pytest
+
+from src.storage import JSONStream, load_tx_info, load_blockchain
+
+
+DOCUMENT = {
+    'numbers': [0, 7, -12, 123456789, 3.25, 1e-7, 10 ** 20],
+    'strings': ['', 'plain', 'quote " and backslash \\', 'escapes \n\t\u0001', 'é€ 漢字 🎉'],
+    'nested': {'a': [{'b': None, 'c': True}, [], {}], 'd': False},
+    'ünïcödé kéy': '𝄞' * 10
+}
+
+
+def stream(document, chunk_size, offset=0):
+    return JSONStream(io.BytesIO(document.encode()), offset=offset, chunk_size=chunk_size)
+
+
+def decode(jsonstream):
+    """
+    Decode a whole object with items/elements, the way load_blockchain walks a file
+    """
+
+    result = {}
+    for key, value in jsonstream.items():
+        if key == 'numbers' or key == 'strings':
+            result[key] = list(value.elements())
+        else:
+            result[key] = value.value()
+
+    return result
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5, 7, 16, 1 << 20])
+def test_chunk_boundaries(chunk_size):
+    document = json.dumps(DOCUMENT)
+    assert decode(stream(document, chunk_size)) == DOCUMENT
+
+    # Whitespace between tokens, as in files written with indent
+    document = json.dumps(DOCUMENT, indent=4)
+    assert decode(stream(document, chunk_size)) == DOCUMENT
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5])
+def test_number_split_across_chunks(chunk_size):
+    assert list(stream('[123456789, 987654321.5, -42]', chunk_size).elements()) == [123456789, 987654321.5, -42]
+    assert stream('123456789', chunk_size).value() == 123456789
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5])
+def test_multibyte_utf8(chunk_size):
+    # 2, 3 and 4 byte characters land on every possible split
+    document = json.dumps({'€': 'é€漢🎉', 'x': ['🎉' * 3, 'é' * 5]}, ensure_ascii=False)
+    assert decode(stream(document, chunk_size)) == json.loads(document)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1 << 20])
+def test_tell_is_a_byte_offset(chunk_size):
+    document = json.dumps({'first': 'é€🎉' * 5, 'second': {'k': 'v'}}, ensure_ascii=False)
+
+    jsonstream = stream(document, chunk_size)
+    for key, value in jsonstream.items():
+        if key == 'second':
+            offset = jsonstream.tell()
+            break
+
+    # Reading again from the offset finds the value
+    assert stream(document, chunk_size, offset=offset).value() == {'k': 'v'}
+
+
+def test_undecoded_values_are_skipped():
+    document = json.dumps({'skipped': {'deep': [1, 2, {'x': 'y'}]}, 'kept': [1, 2]})
+    assert {key: value.value() for key, value in stream(document, 4).items() if key == 'kept'} == {'kept': [1, 2]}
+
+
+@pytest.mark.parametrize('document', ['{"a": 1', '{"a" 1}', '[1, 2', '{"a": 1,}'])
+def test_truncated_or_invalid(document):
+    with pytest.raises(ValueError):
+        decode(stream(document, 2))
+
+
+def blockchain_file(tmp_path, keys):
+    """
+    Write a small blockchain file with its keys in the given order
+
+    @return: (<str> filename, <dict> data)
+    """
+
+    data = {
+        'pruned_height': 0,
+        'chain': [
+            {'header': {'index': 1, 'previous_hash': 1, 'proof': 100, 'timestamp': 1.5, 'merkle_root': 'é'},
+             'transactions': ['a€']},
+            {'header': {'index': 2, 'previous_hash': 'h', 'proof': 7, 'timestamp': 2.5, 'merkle_root': '🎉'},
+             'transactions': ['b']}
+        ],
+        'tx_info': {'0': None, 'a€': {'amount': 1, 'memo': '漢字'}, 'b': {'amount': 2}}
+    }
+
+    filename = str(tmp_path / 'blockchain.json')
+    with open(filename, 'w') as outfile:
+        json.dump({key: data[key] for key in keys}, outfile, indent=4, ensure_ascii=False)
+
+    return filename, data
+
+
+@pytest.mark.parametrize('keys', [
+    ('pruned_height', 'chain', 'tx_info'),
+    ('chain', 'tx_info', 'pruned_height'),
+    ('tx_info', 'chain', 'pruned_height'),
+    ('tx_info', 'pruned_height', 'chain')
+])
+def test_load_blockchain_key_order(tmp_path, keys):
+    filename, data = blockchain_file(tmp_path, keys)
+
+    blockchain = load_blockchain(filename)
+    assert blockchain.chain == data['chain']
+    assert blockchain.tx_info == data['tx_info']
+    assert blockchain.pruned_height == 0
+
+    headers = load_blockchain(filename, headers_only=True)
+    assert headers.chain == [block['header'] for block in data['chain']]
+
+
+def test_load_tx_info_offset(tmp_path):
+    filename, data = blockchain_file(tmp_path, ('pruned_height', 'chain', 'tx_info'))
+
+    with open(filename, 'rb') as infile:
+        jsonstream = JSONStream(infile, chunk_size=3)
+        offset = next(jsonstream.tell() for key, _ in jsonstream.items() if key == 'tx_info')
+
+    assert load_tx_info(filename, offset) == data['tx_info']
+
+
+def test_load_blockchain_without_chain(tmp_path):
+    filename = str(tmp_path / 'blockchain.json')
+    with open(filename, 'w') as outfile:
+        json.dump({'tx_info': {}}, outfile)
+
+    with pytest.raises(ValueError):
+        load_blockchain(filename)
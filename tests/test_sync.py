@@ -0,0 +1,152 @@
+import copy
+
+from src.blockchain import Blockchain
+from src.sync import BlockDownloader
+
+
+def grow(blockchain, height, recipient='miner'):
+    """
+    Add blocks up to a height (Proof of Work isn't checked by the downloader, the headers are already verified)
+    """
+
+    while len(blockchain.chain) < height:
+        blockchain.add_reward(recipient)
+        blockchain.add_block(proof=0)
+
+    return blockchain
+
+
+def fork(blockchain, height):
+    """
+    @return: <Blockchain> Copy of the first `height` blocks
+    """
+
+    return Blockchain(copy.deepcopy(blockchain.chain[:height]), copy.deepcopy(blockchain.tx_info))
+
+
+def headers(blockchain):
+    return [block['header'] for block in blockchain.chain]
+
+
+def answer(downloader, blockchain, requests, peer=None):
+    """
+    Answer requests with the blocks of a blockchain
+
+    @return: [<bool>] Result of every answer
+    """
+
+    results = []
+    for requested_peer, request_id, indices in requests:
+        blocks = [blockchain.chain[index - 1] for index in indices]
+        tx_info = {tx_hash: blockchain.tx_info[tx_hash] for block in blocks for tx_hash in block['transactions']}
+        results.append(downloader.receive(peer or requested_peer, request_id, blocks, tx_info, size=1000))
+
+    return results
+
+
+def test_download():
+    blockchain = grow(Blockchain(), 40)
+    downloader = BlockDownloader(headers(blockchain), start=2, window=8, max_inflight=2)
+
+    requests = downloader.assign({'a': 40, 'b': 40})
+    assert sorted(len(indices) for _, _, indices in requests) == [8, 8, 8, 8]
+    assert all(answer(downloader, blockchain, requests))
+
+    while not downloader.complete:
+        assert all(answer(downloader, blockchain, downloader.assign({'a': 40, 'b': 40})))
+
+    assert downloader.chain() == blockchain.chain[1:]
+
+
+def test_peers_without_the_blocks():
+    blockchain = grow(Blockchain(), 20)
+    downloader = BlockDownloader(headers(blockchain), start=2, window=8)
+
+    # Too short for any window, or pruned all but the last one
+    [(peer, _, indices)] = downloader.assign({'short': 5, 'pruned': 20}, {'pruned': 15})
+    assert peer == 'pruned' and indices == [18, 19, 20]
+
+
+def test_stalled_requests_go_to_another_peer():
+    blockchain = grow(Blockchain(), 10)
+    downloader = BlockDownloader(headers(blockchain), start=2, window=16, timeout=2)
+
+    [(peer, _, indices)] = downloader.assign({'slow': 10}, now=0)
+    assert downloader.check_stalls(now=3) == ['slow']
+
+    [(peer, _, retried)] = downloader.assign({'slow': 10, 'fast': 10}, now=3)
+    assert peer == 'fast' and retried == indices
+
+
+def test_blocks_not_matching_the_headers():
+    blockchain = grow(Blockchain(), 10)
+    other = grow(fork(blockchain, 1), 10, recipient='other')
+    downloader = BlockDownloader(headers(blockchain), start=2)
+
+    assert answer(downloader, other, downloader.assign({'liar': 10})) == [False]
+    assert downloader.blocks == {}
+
+
+def test_extend_keeps_the_downloaded_blocks():
+    blockchain = grow(Blockchain(), 20)
+    downloader = BlockDownloader(headers(blockchain), start=2, window=4, max_inflight=1)
+
+    assert all(answer(downloader, blockchain, downloader.assign({'a': 20, 'b': 20})))
+    downloaded = dict(downloader.blocks)
+    inflight = downloader.assign({'a': 20, 'b': 20})
+
+    # A block was mined meanwhile
+    grow(blockchain, 21)
+    downloader.extend(headers(blockchain), start=2)
+
+    assert downloader.height == 21
+    assert downloader.blocks == downloaded
+
+    # Requests sent before are still answered, nothing is asked twice
+    assert all(answer(downloader, blockchain, inflight))
+    requested = []
+    while not downloader.complete:
+        requests = downloader.assign({'a': 21, 'b': 21})
+        requested += [index for _, _, indices in requests for index in indices]
+        assert all(answer(downloader, blockchain, requests))
+
+    assert len(requested) == len(set(requested))
+    assert not set(requested) & set(downloaded)
+    assert downloader.chain() == blockchain.chain[1:]
+
+
+def test_extend_to_a_fork():
+    blockchain = grow(Blockchain(), 20)
+    downloader = BlockDownloader(headers(blockchain), start=2, window=4, max_inflight=4)
+    inflight = downloader.assign({'a': 20})
+
+    # Blocks after 10 are replaced
+    other = grow(fork(blockchain, 10), 22, recipient='other')
+    downloader.extend(headers(other), start=2)
+    assert not any(index > 10 for index in downloader.blocks)
+
+    # Answers of dropped requests are only kept if they match the new headers
+    answer(downloader, blockchain, inflight)
+    assert all(downloader.blocks[index] is blockchain.chain[index - 1] for index in downloader.blocks)
+    assert not any(index > 10 for index in downloader.blocks)
+
+    while not downloader.complete:
+        assert all(answer(downloader, other, downloader.assign({'a': 22})))
+
+    assert downloader.chain() == other.chain[1:]
+    assert set(downloader.tx_info) == {tx_hash for block in other.chain[1:] for tx_hash in block['transactions']}
+
+
+def test_extend_after_our_chain_grew():
+    blockchain = grow(Blockchain(), 20)
+    downloader = BlockDownloader(headers(blockchain), start=2, window=4)
+    assert all(answer(downloader, blockchain, downloader.assign({'a': 20})))
+
+    # Blocks up to 5 were added to our chain meanwhile
+    downloader.extend(headers(blockchain), start=6)
+    assert min(downloader.blocks) >= 6
+
+    while not downloader.complete:
+        assert all(answer(downloader, blockchain, downloader.assign({'a': 20})))
+
+    assert downloader.chain() == blockchain.chain[5:]
@@ -0,0 +1,66 @@
+from shortuuid import uuid
+import time
+import logging
+import argparse
+
+from src.nodes import PoolWorkerNode
+from src.peers import AddressBook
+from src.metrics import SamplingProfiler, start_exporters
+
+
+"""
+===========
+ MAIN CODE
+===========
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=str, help='node name')
+parser.add_argument('-p', type=int, help='port number (default: 5000)')
+parser.add_argument('--peers', type=str, help='file of the peers known from previous runs (default: \'peers.json\')')
+parser.add_argument('--log', type=str, help='log level, DEBUG shows every packet (default: \'INFO\')')
+parser.add_argument('--metrics-port', type=int, help='serve metrics in the Prometheus text format on this port')
+parser.add_argument('--metrics-file', type=str, help='write a snapshot of the metrics to this file every 10 seconds')
+parser.add_argument('--profile', type=str, help='profile a sample of the packets handled into this file')
+
+args = parser.parse_args()
+node_id = uuid()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=(args.log or 'INFO').upper(), format='%(message)s')
+    profiler = SamplingProfiler() if args.profile else None
+
+    node = PoolWorkerNode(
+        name=args.n or f'node-{node_id}',
+        port=args.p or 5000,
+        profiler=profiler,
+        address_book=AddressBook(args.peers or 'peers.json')
+    )
+    exporters = start_exporters(node.metrics, port=args.metrics_port, filename=args.metrics_file)
+
+    try:
+        print(f'Starting node-{node_id}')
+
+        # Establish Connection, with the peers of the previous run first
+        while not node.connect():
+            pass
+
+        # Find a pool coordinator
+        while not node.request_work():
+            node.send_version()
+            time.sleep(5)
+
+        # Search the ranges of proofs handed out by the coordinator
+        while True:
+            if not node.mine():
+                # The request or its work got lost
+                time.sleep(1)
+                if not node.work:
+                    node.request_work()
+
+    except (EOFError, KeyboardInterrupt):
+        node.stop()
+
+        [exporter.stop() for exporter in exporters]
+        if profiler:
+            profiler.dump(args.profile)